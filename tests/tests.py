@@ -4,11 +4,38 @@ from urdfModifiers.core.modification import Modification
 from urdfModifiers.core.linkModifier import LinkModifier
 from urdfModifiers.core.jointModifier import JointModifier
 from urdfModifiers.core.fixedOffsetModifier import FixedOffsetModifier
+from urdfModifiers.core.robotIndex import RobotIndex
+from urdfModifiers.core.inertiaBatch import InertiaBatch
+from urdfModifiers.core.parameterVector import ParameterVector
+from urdfModifiers.core.poseCache import PoseCache
+from urdfModifiers.core.massPropertiesTracker import MassPropertiesTracker
+from urdfModifiers.core.modificationPlan import ModificationPlan, ModificationStep
+from urdfModifiers.core.evaluation import RobotEvaluation
+from urdfModifiers.core.modifier import attach_observer, _element_observers
+from urdfModifiers.core.modificationJournal import ModificationJournal, robot_transaction
 from urdfModifiers.geometry import *
-from urdfModifiers.geometry.geometry import Side
+from urdfModifiers.geometry.geometry import Limb, Side
 from urdfModifiers.utils import *
-from urchin import matrix_to_xyz_rpy 
+from urdfModifiers.utils import variants
+from urdfModifiers.utils import patch
+from urdfModifiers.utils import document
+from urdfModifiers.utils import cache
+from urchin import URDF, Material, Texture, matrix_to_xyz_rpy 
+from lxml import etree
 import math
+import numpy as np
+import io
+import gzip
+import pickle
+import gc
+import weakref
+import types
+import tempfile
+import shutil
+import os
+import configparser
+import json
+import trimesh
 
 """
 Test Model:
@@ -625,6 +652,96 @@ class LinkModifierTests(unittest.TestCase):
         self.assertEqual(matrix_to_xyz_rpy(modified_link.visuals[0].origin)[2],
                          matrix_to_xyz_rpy(original_link.visuals[0].origin)[2])
 
+    def test_origin_position_keeps_rotation(self):
+
+        modifier = LinkModifier.from_name('non_aligned_link', self.modified_robot, axis=geometry.Side.X)
+
+        modification = Modification()
+        modification.add_position(3, absolute=True)
+
+        modifier.modify(modification)
+
+        original_link = [link for link in self.original_robot.links if link.name == 'non_aligned_link'][0]
+        modified_link = [link for link in self.modified_robot.links if link.name == 'non_aligned_link'][0]
+
+        self.assertTrue((modified_link.visuals[0].origin[0:3,0:3] == original_link.visuals[0].origin[0:3,0:3]).all())
+        self.assertTrue((modified_link.collisions[0].origin == modified_link.visuals[0].origin).all())
+        self.assertTrue((modified_link.inertial.origin == modified_link.visuals[0].origin).all())
+        self.assertIsNot(modified_link.collisions[0].origin, modified_link.visuals[0].origin)
+
+    def test_origin_position_vector_is_changed(self):
+
+        modifier = LinkModifier.from_name('non_aligned_link', self.modified_robot, axis=geometry.Side.X)
+
+        modification = Modification()
+        modification.add_position_vector([3, 4, 5], absolute=True, mask=[1, 0, 1])
+
+        modifier.modify(modification)
+
+        original_link = [link for link in self.original_robot.links if link.name == 'non_aligned_link'][0]
+        modified_link = [link for link in self.modified_robot.links if link.name == 'non_aligned_link'][0]
+
+        self.assertEqual(list(modified_link.visuals[0].origin[0:3,3]),
+                         [3, original_link.visuals[0].origin[1,3], 5])
+        self.assertTrue((modified_link.collisions[0].origin == modified_link.visuals[0].origin).all())
+
+    def test_position_modification_keeps_inertia(self):
+
+        modifier = LinkModifier.from_name('non_aligned_link', self.modified_robot)
+        modified_link = [link for link in self.modified_robot.links if link.name == 'non_aligned_link'][0]
+        custom_inertia = np.array([[1.0, 0.1, 0.0], [0.1, 2.0, 0.0], [0.0, 0.0, 3.0]])
+        modified_link.inertial.inertia = custom_inertia
+
+        modification = Modification()
+        modification.add_position_vector([3, 4, 5], absolute=True)
+
+        modifier.modify(modification)
+
+        self.assertTrue((modified_link.inertial.inertia == custom_inertia).all())
+
+    def test_mass_modification_scales_inertia(self):
+
+        modifier = LinkModifier.from_name('non_aligned_link', self.modified_robot)
+        modified_link = [link for link in self.modified_robot.links if link.name == 'non_aligned_link'][0]
+        custom_inertia = np.array([[1.0, 0.1, 0.0], [0.1, 2.0, 0.0], [0.0, 0.0, 3.0]])
+        modified_link.inertial.inertia = custom_inertia
+
+        modification = Modification()
+        modification.add_mass(3, absolute=False)
+
+        modifier.modify(modification)
+
+        np.testing.assert_allclose(modified_link.inertial.inertia, custom_inertia * 3)
+
+    def test_mass_modification_recomputes_clamped_inertia(self):
+
+        modifier = LinkModifier.from_name('aligned_link', self.modified_robot)
+        radius_modification = Modification()
+        radius_modification.add_radius(0.5, absolute=False)
+        modifier.modify(radius_modification)
+        self.assertEqual(modifier.element.inertial.inertia[2, 2], 0.01)
+
+        mass_modification = Modification()
+        mass_modification.add_mass(10, absolute=True)
+        modifier.modify(mass_modification)
+
+        self.assertAlmostEqual(modifier.element.inertial.inertia[2, 2], 0.05)
+
+    def test_inertia_jacobian_matches_finite_differences(self):
+
+        modifier = LinkModifier.from_name('aligned_link', self.modified_robot)
+        mass_gradient, inertia_jacobian = modifier.calculate_inertia_jacobian()
+
+        density = modifier.calculate_density()
+        original_mass = modifier.get_mass()
+        original_inertia = modifier.calculate_inertia()
+        step = 1e-7
+        modifier.set_length(modifier.get_significant_length() + step)
+        modifier.set_density(density)
+
+        self.assertAlmostEqual((modifier.get_mass() - original_mass) / step, mass_gradient[0], places=5)
+        np.testing.assert_allclose((modifier.calculate_inertia() - original_inertia) / step, inertia_jacobian[:, 0], rtol=1e-5)
+
     def test_dimension_fails_if_geometry_is_sphere(self):
 
         modifier = LinkModifier.from_name('base_link', self.modified_robot)
@@ -668,6 +785,21 @@ class JointModifierTests(unittest.TestCase):
         self.assertEqual(matrix_to_xyz_rpy(modified_joint.origin)[2],
                          matrix_to_xyz_rpy(original_joint.origin)[2])
 
+    def test_relative_joint_position_vector_change(self):
+
+        modifier = JointModifier.from_name('non_aligned_link_joint_after', self.modified_robot)
+
+        modification = Modification()
+        modification.add_position_vector([2, 3, 4], absolute=False, mask=[0, 1, 1])
+
+        modifier.modify(modification)
+
+        original_joint = [joint for joint in self.original_robot.joints if joint.name == 'non_aligned_link_joint_after'][0]
+        modified_joint = [joint for joint in self.modified_robot.joints if joint.name == 'non_aligned_link_joint_after'][0]
+
+        self.assertEqual(list(modified_joint.origin[0:3,3]),
+                         [original_joint.origin[0,3], original_joint.origin[1,3] * 3, original_joint.origin[2,3] * 4])
+
     def test_relative_joint_change_x_from_0(self):
 
         modifier = JointModifier.from_name('aligned_link_joint_before', self.modified_robot, axis=geometry.Side.X)
@@ -1107,6 +1239,1125 @@ class FixedOffsetModifierTests(unittest.TestCase):
         modified_joint = [joint for joint in self.modified_robot.joints if joint.name == 'aligned_link_joint_after'][0]
         self.assertEqual(modified_joint.joint_type, geometry.JointType.REVOLUTE)
 
+    def test_origin_jacobian_matches_finite_differences(self):
+        modifier = FixedOffsetModifier.from_name('non_aligned_link', self.modified_robot)
+        visual_origin_gradient, joint_origin_gradients = modifier.calculate_origin_jacobian()
+
+        original_visual_origin = modifier.link.visuals[0].origin[0:3,3].copy()
+        original_joint_origin = modifier.child_joint_list[0].origin[0:3,3].copy()
+        step = 1e-7
+        modifier.change_dimension_and_keep_offsets(modifier.get_significant_length() + step, [1, 1, 1])
+
+        np.testing.assert_allclose((modifier.link.visuals[0].origin[0:3,3] - original_visual_origin) / step, visual_origin_gradient, atol=1e-6)
+        np.testing.assert_allclose((modifier.child_joint_list[0].origin[0:3,3] - original_joint_origin) / step, joint_origin_gradients[0], atol=1e-6)
+
+    def test_offsets_array_matches_offsets(self):
+        modifiers = FixedOffsetModifier.for_subtree('base_link', self.modified_robot)
+
+        offsets = FixedOffsetModifier.calculate_offsets_array(modifiers)
+
+        for i, modifier in enumerate(modifiers):
+            parent_joint_offset, child_joint_offset = modifier.calculate_offsets()
+            array_parent_joint_offset, array_child_joint_offset = offsets.get_offsets(i)
+            self.assertEqual(array_parent_joint_offset, parent_joint_offset)
+            self.assertEqual(array_child_joint_offset, child_joint_offset)
+
+    def test_subtree_skips_mesh_links(self):
+        with open(self.original_filename, 'rb') as f:
+            original_bytes = f.read()
+        with tempfile.TemporaryDirectory() as model_dir:
+            robot = utils.load_robot_from_bytes(add_mesh_link(original_bytes, model_dir), model_dir)
+
+        modifiers = FixedOffsetModifier.for_subtree('non_aligned_link', robot)
+
+        self.assertEqual([modifier.link.name for modifier in modifiers], ['non_aligned_link', 'connector_link_2'])
+        self.assertEqual([link_modifier.element.name for link_modifier in InertiaBatch.from_robot(robot).link_modifiers][-1], 'connector_link_2')
+
+    def test_chain_dimension_change_matches_single_changes(self):
+        expected_robot = copy.deepcopy(self.original_robot)
+        expected_modifiers = FixedOffsetModifier.for_subtree('aligned_link', expected_robot)
+        new_lengths = [modifier.get_significant_length() * 1.5 for modifier in expected_modifiers]
+        for modifier, new_length in zip(expected_modifiers, new_lengths):
+            modifier.change_dimension_and_keep_offsets(new_length, [1, 0, 1])
+
+        modifiers = FixedOffsetModifier.for_subtree('aligned_link', self.modified_robot)
+        FixedOffsetModifier.change_dimensions_and_keep_offsets(modifiers, new_lengths, [1, 0, 1])
+
+        for expected_link, modified_link in zip(expected_robot.links, self.modified_robot.links):
+            np.testing.assert_allclose(modified_link.visuals[0].origin, expected_link.visuals[0].origin)
+            np.testing.assert_allclose(modified_link.inertial.inertia, expected_link.inertial.inertia)
+        for expected_joint, modified_joint in zip(expected_robot.joints, self.modified_robot.joints):
+            np.testing.assert_allclose(modified_joint.origin, expected_joint.origin)
+
+    def test_bulk_modifiers_match_single_modifiers(self):
+        link_names = ['aligned_link', 'non_aligned_link']
+        modifiers = FixedOffsetModifier.for_links(link_names, self.modified_robot)
+
+        for link_name, modifier in zip(link_names, modifiers):
+            single_modifier = FixedOffsetModifier.from_name(link_name, self.modified_robot)
+            self.assertIs(modifier.link, single_modifier.link)
+            self.assertIs(modifier.parent_joint, single_modifier.parent_joint)
+            self.assertEqual(modifier.child_joint_list, single_modifier.child_joint_list)
+
+    def test_subtree_modifiers_follow_the_tree(self):
+        modifiers = FixedOffsetModifier.for_subtree('aligned_link', self.modified_robot)
+
+        self.assertEqual([modifier.link.name for modifier in modifiers],
+                         ['aligned_link', 'connector_link_1', 'non_aligned_link', 'connector_link_2'])
+
+class InertiaBatchTests(unittest.TestCase):
+
+    def __init__(self, *args, **kwargs):
+        super(InertiaBatchTests, self).__init__(*args, **kwargs)
+        self.original_filename = 'tests/test_model.urdf'
+        self.original_robot, _ = utils.load_robot_and_gazebo_plugins(self.original_filename)
+
+    def setUp(self):
+        self.modified_robot = copy.deepcopy(self.original_robot)
+
+    def test_batch_inertias_match_link_modifier(self):
+        batch = InertiaBatch.from_robot(self.modified_robot)
+
+        batch.update_inertias()
+
+        for link_modifier in batch.link_modifiers:
+            expected_inertia = np.maximum(link_modifier.calculate_inertia(), 0.01)
+            np.testing.assert_allclose(link_modifier.element.inertial.inertia, np.diag(expected_inertia))
+
+    def test_density_is_changed_for_every_link(self):
+        batch = InertiaBatch.from_robot(self.modified_robot)
+
+        batch.set_densities(2.0)
+        batch.update_inertias()
+
+        for link_modifier in batch.link_modifiers:
+            self.assertAlmostEqual(link_modifier.calculate_density(), 2.0)
+        np.testing.assert_allclose(batch.inertia_tensors,
+                                   [link_modifier.element.inertial.inertia for link_modifier in batch.link_modifiers])
+
+    def test_rescaled_inertias_keep_off_diagonal_terms(self):
+        batch = InertiaBatch.from_robot(self.modified_robot)
+        original_tensors = batch.get_inertia_tensors()
+        original_tensors[:, 0, 1] = original_tensors[:, 1, 0] = 0.001
+
+        for link_modifier, tensor in zip(batch.link_modifiers, original_tensors):
+            link_modifier.element.inertial.inertia = tensor
+        batch.rescale_inertias(batch.masses * 2)
+        batch.write_back()
+
+        np.testing.assert_allclose(batch.get_inertia_tensors(), original_tensors * 2)
+
+    def test_rescaled_clamped_inertias_are_recomputed(self):
+        batch = InertiaBatch.from_robot(self.modified_robot)
+        aligned_link_index = [link_modifier.element.name for link_modifier in batch.link_modifiers].index('aligned_link')
+        batch.link_modifiers[aligned_link_index].set_radius(0.1)
+        batch.pack()
+        batch.update_inertias()
+
+        batch.rescale_inertias(batch.masses * 10)
+        rescaled_tensors = batch.inertia_tensors.copy()
+        batch.update_inertias()
+
+        np.testing.assert_allclose(rescaled_tensors, batch.inertia_tensors)
+
+    def test_batch_jacobians_match_link_modifier(self):
+        batch = InertiaBatch.from_robot(self.modified_robot)
+
+        mass_gradients, inertia_jacobians = batch.calculate_jacobians()
+
+        for i, link_modifier in enumerate(batch.link_modifiers):
+            mass_gradient, inertia_jacobian = link_modifier.calculate_inertia_jacobian()
+            np.testing.assert_allclose(mass_gradients[i], mass_gradient)
+            np.testing.assert_allclose(inertia_jacobians[i], inertia_jacobian)
+
+class ParameterVectorTests(unittest.TestCase):
+
+    def __init__(self, *args, **kwargs):
+        super(ParameterVectorTests, self).__init__(*args, **kwargs)
+        self.original_filename = 'tests/test_model.urdf'
+        self.original_robot, _ = utils.load_robot_and_gazebo_plugins(self.original_filename)
+
+    def setUp(self):
+        self.modified_robot = copy.deepcopy(self.original_robot)
+        self.parameter_vector = ParameterVector()
+        self.parameter_vector.add_link_parameter('aligned_link', geometry.ParameterType.LENGTH, keep_offsets=True)
+        self.parameter_vector.add_link_parameter('aligned_link', geometry.ParameterType.DENSITY)
+        self.parameter_vector.add_link_parameter('base_link', geometry.ParameterType.RADIUS)
+        self.parameter_vector.add_link_parameter('non_aligned_link', geometry.ParameterType.MASS)
+        self.parameter_vector.add_joint_parameter('non_aligned_link_joint_after', geometry.Side.X)
+
+    def test_extract_returns_current_values(self):
+        x = self.parameter_vector.extract(self.modified_robot)
+
+        self.assertEqual(self.parameter_vector.names,
+                         ['aligned_link.length', 'aligned_link.density', 'base_link.radius', 'non_aligned_link.mass', 'non_aligned_link_joint_after.position.x'])
+        np.testing.assert_allclose(x, [2, 1 / (math.pi * 0.2 ** 2 * 2), 0.5, 1, 0])
+
+    def test_offset_masks_are_not_shared(self):
+        self.parameter_vector.parameters[0].offset_mask[2] = 0
+        parameter_vector = ParameterVector()
+        slot = parameter_vector.add_link_parameter('aligned_link', geometry.ParameterType.LENGTH, keep_offsets=True)
+
+        self.assertEqual(self.parameter_vector.parameters[1].offset_mask, [1, 1, 1])
+        self.assertEqual(parameter_vector.parameters[slot].offset_mask, [1, 1, 1])
+
+    def test_apply_matches_modifiers(self):
+        x = self.parameter_vector.extract(self.modified_robot)
+        x[0] = 4
+        x[1] = 2
+        x[3] = 3
+
+        self.parameter_vector.apply(self.modified_robot, x)
+
+        expected_robot = copy.deepcopy(self.original_robot)
+        modification = Modification()
+        modification.add_dimension(4, absolute=True)
+        FixedOffsetModifier.from_name('aligned_link', expected_robot).modify(modification)
+        modification = Modification()
+        modification.add_density(2, absolute=True)
+        LinkModifier.from_name('aligned_link', expected_robot).modify(modification)
+        modification = Modification()
+        modification.add_mass(3, absolute=True)
+        LinkModifier.from_name('non_aligned_link', expected_robot).modify(modification)
+
+        np.testing.assert_allclose(self.parameter_vector.extract(self.modified_robot), x)
+        for expected_link, modified_link in zip(expected_robot.links, self.modified_robot.links):
+            self.assertAlmostEqual(modified_link.inertial.mass, expected_link.inertial.mass)
+            np.testing.assert_allclose(modified_link.inertial.inertia, expected_link.inertial.inertia)
+            np.testing.assert_allclose(modified_link.visuals[0].origin, expected_link.visuals[0].origin)
+        for expected_joint, modified_joint in zip(expected_robot.joints, self.modified_robot.joints):
+            np.testing.assert_allclose(modified_joint.origin, expected_joint.origin)
+
+class PoseCacheTests(unittest.TestCase):
+
+    def __init__(self, *args, **kwargs):
+        super(PoseCacheTests, self).__init__(*args, **kwargs)
+        self.original_filename = 'tests/test_model.urdf'
+        self.original_robot, _ = utils.load_robot_and_gazebo_plugins(self.original_filename)
+
+    def setUp(self):
+        self.modified_robot = copy.deepcopy(self.original_robot)
+        self.pose_cache = PoseCache.of(self.modified_robot)
+
+    def tearDown(self):
+        self.pose_cache.detach()
+
+    def test_poses_match_forward_kinematics(self):
+        link_poses = self.modified_robot.link_fk()
+
+        for link in self.modified_robot.links:
+            np.testing.assert_allclose(self.pose_cache.get_link_pose(link.name), link_poses[link])
+        self.assertIs(PoseCache.of(self.modified_robot), self.pose_cache)
+
+    def test_joint_modification_only_invalidates_subtree(self):
+        self.pose_cache.get_link_poses()
+
+        modifier = FixedOffsetModifier.from_name('non_aligned_link', self.modified_robot)
+        modification = Modification()
+        modification.add_dimension(2, absolute=False)
+        modifier.modify(modification)
+
+        self.assertEqual(self.pose_cache.dirty_links, {'connector_link_2'})
+        link_poses = self.modified_robot.link_fk()
+        for link in self.modified_robot.links:
+            np.testing.assert_allclose(self.pose_cache.get_link_pose(link.name), link_poses[link])
+
+    def test_copies_do_not_share_pose_cache(self):
+        shallow_copy = copy.copy(self.modified_robot)
+        deep_copy = copy.deepcopy(self.modified_robot)
+
+        self.assertIsNot(PoseCache.of(shallow_copy), self.pose_cache)
+        self.assertIsNot(PoseCache.of(deep_copy), self.pose_cache)
+        self.assertIs(PoseCache.of(deep_copy).robot, deep_copy)
+        self.assertIs(PoseCache.of(self.modified_robot), self.pose_cache)
+        PoseCache.of(shallow_copy).detach()
+        PoseCache.of(deep_copy).detach()
+
+class MassPropertiesTrackerTests(unittest.TestCase):
+
+    def __init__(self, *args, **kwargs):
+        super(MassPropertiesTrackerTests, self).__init__(*args, **kwargs)
+        self.original_filename = 'tests/test_model.urdf'
+        self.original_robot, _ = utils.load_robot_and_gazebo_plugins(self.original_filename)
+
+    def setUp(self):
+        self.modified_robot = copy.deepcopy(self.original_robot)
+        self.tracker = MassPropertiesTracker.of(self.modified_robot)
+
+    def tearDown(self):
+        self.tracker.detach()
+
+    def calculate_mass_properties(self, robot):
+        link_poses = robot.link_fk()
+        total_mass = 0
+        first_moment = np.zeros(3)
+        origin_inertia = np.zeros((3, 3))
+        for link in robot.links:
+            inertial_pose = np.dot(link_poses[link], link.inertial.origin)
+            rotation_matrix = inertial_pose[0:3, 0:3]
+            center_of_mass = inertial_pose[0:3, 3]
+            total_mass += link.inertial.mass
+            first_moment += link.inertial.mass * center_of_mass
+            origin_inertia += (np.dot(rotation_matrix, np.dot(link.inertial.inertia, rotation_matrix.T)) +
+                               link.inertial.mass * (np.dot(center_of_mass, center_of_mass) * np.eye(3) - np.outer(center_of_mass, center_of_mass)))
+        center_of_mass = first_moment / total_mass
+        inertia = origin_inertia - total_mass * (np.dot(center_of_mass, center_of_mass) * np.eye(3) - np.outer(center_of_mass, center_of_mass))
+        return total_mass, center_of_mass, inertia
+
+    def assert_matches_full_computation(self):
+        total_mass, center_of_mass, inertia = self.calculate_mass_properties(self.modified_robot)
+        self.assertAlmostEqual(self.tracker.get_total_mass(), total_mass)
+        np.testing.assert_allclose(self.tracker.get_center_of_mass(), center_of_mass, atol=1e-12)
+        np.testing.assert_allclose(self.tracker.get_composite_inertia(), inertia, atol=1e-12)
+
+    def test_mass_properties_match_full_computation(self):
+        self.assert_matches_full_computation()
+        self.assertEqual(self.tracker.dirty_links, set())
+        self.assertIs(MassPropertiesTracker.of(self.modified_robot), self.tracker)
+
+    def test_link_modification_only_invalidates_ancestors(self):
+        self.tracker.get_total_mass()
+
+        modifier = LinkModifier.from_name('non_aligned_link', self.modified_robot, geometry.Side.Z)
+        modification = Modification()
+        modification.add_mass(3, absolute=True)
+        modifier.modify(modification)
+
+        self.assertEqual(self.tracker.dirty_links, {'non_aligned_link', 'connector_link_1', 'aligned_link', 'base_link'})
+        self.assert_matches_full_computation()
+
+    def test_offset_modification_updates_mass_properties(self):
+        self.tracker.get_total_mass()
+
+        modifier = FixedOffsetModifier.from_name('non_aligned_link', self.modified_robot)
+        modification = Modification()
+        modification.add_dimension(2, absolute=False)
+        modifier.modify(modification)
+
+        self.assert_matches_full_computation()
+
+class ModificationPlanTests(unittest.TestCase):
+
+    def __init__(self, *args, **kwargs):
+        super(ModificationPlanTests, self).__init__(*args, **kwargs)
+        self.original_filename = 'tests/test_model.urdf'
+        self.original_robot, _ = utils.load_robot_and_gazebo_plugins(self.original_filename)
+        self.config = configparser.ConfigParser()
+        self.config.read_string("[aligned_link]\ndimension_scale = 2.0\n[arms]\nmass = 3.0\n")
+        self.selectors = {Limb.ARMS: ['non_aligned_link', 'connector_link_2']}
+
+    def setUp(self):
+        self.modified_robot = copy.deepcopy(self.original_robot)
+
+    def apply_manually(self, robot):
+        dimension_modification = Modification()
+        dimension_modification.add_dimension(2.0, absolute=False)
+        LinkModifier.from_name('aligned_link', robot, Side.Z).modify(dimension_modification)
+        mass_modification = Modification()
+        mass_modification.add_mass(3.0, absolute=True)
+        for link_name in self.selectors[Limb.ARMS]:
+            LinkModifier.from_name(link_name, robot, Side.Z).modify(mass_modification)
+
+    def test_compiled_plan_matches_modifiers(self):
+        plan = ModificationPlan.compile(self.config, RobotIndex(self.modified_robot), self.selectors)
+        plan.apply(self.modified_robot)
+        expected_robot = copy.deepcopy(self.original_robot)
+        self.apply_manually(expected_robot)
+
+        self.assertEqual([step.element_name for step in plan.steps], ['aligned_link', 'non_aligned_link', 'connector_link_2'])
+        for link, expected_link in zip(self.modified_robot.links, expected_robot.links):
+            self.assertEqual(link.inertial.mass, expected_link.inertial.mass)
+            np.testing.assert_allclose(link.inertial.inertia, expected_link.inertial.inertia)
+            np.testing.assert_allclose(link.visuals[0].origin, expected_link.visuals[0].origin)
+
+    def test_pickled_plan_is_applied_to_new_robot(self):
+        plan = ModificationPlan.compile(self.config, RobotIndex(self.modified_robot), self.selectors)
+        unpickled_plan = pickle.loads(pickle.dumps(plan))
+        unpickled_plan.apply(self.modified_robot)
+        expected_robot = copy.deepcopy(self.original_robot)
+        self.apply_manually(expected_robot)
+
+        self.assertIsNone(unpickled_plan.__getstate__()['segments'])
+        for link, expected_link in zip(self.modified_robot.links, expected_robot.links):
+            self.assertEqual(link.inertial.mass, expected_link.inertial.mass)
+
+    def test_unknown_element_raises(self):
+        self.config.read_string("[missing_link]\nmass = 1.0\n")
+        with self.assertRaises(Exception):
+            ModificationPlan.compile(self.config, RobotIndex(self.modified_robot), self.selectors)
+
+    def test_sweep_section_is_expanded(self):
+        config = configparser.ConfigParser()
+        config.read_string("[aligned_link]\ndimension_scale = linspace(0.8, 1.2, 3)\ndensity = [500, 1000]\njoint_type = fixed\n")
+
+        with self.assertRaises(Exception):
+            Modification.from_config_section(config['aligned_link'])
+        modifications = list(Modification.sweep_from_config_section(config['aligned_link']))
+        self.assertEqual(len(modifications), 6)
+        self.assertEqual([(item.dimension.value, item.density.value) for item in modifications[:2]], [(0.8, 500.0), (0.8, 1000.0)])
+        self.assertFalse(modifications[0].dimension.absolute)
+        self.assertTrue(modifications[0].density.absolute)
+        self.assertEqual(modifications[0].joint_type, 'fixed')
+
+    def test_sweep_plans_are_generated_lazily(self):
+        config = configparser.ConfigParser()
+        config.read_string("[aligned_link]\ndimension_scale = [1.0, 2.0, 3.0]\n[arms]\nmass = linspace(1, 3, 3)\ndensity = 2\n")
+
+        plans = ModificationPlan.sweep(config, self.selectors)
+        self.assertIsInstance(plans, types.GeneratorType)
+        self.assertEqual(sum(1 for _ in plans), 9)
+
+        zipped_plans = list(ModificationPlan.sweep(config, self.selectors, zipped=True))
+        self.assertEqual(len(zipped_plans), 3)
+        self.assertEqual([plan.steps[0].modification.dimension.value for plan in zipped_plans], [1.0, 2.0, 3.0])
+        self.assertEqual([plan.steps[1].modification.mass.value for plan in zipped_plans], [1.0, 2.0, 3.0])
+        self.assertEqual(zipped_plans[2].steps[2].modification.density.value, 2.0)
+        zipped_plans[1].apply(self.modified_robot)
+        self.assertEqual(self.modified_robot.links[3].inertial.mass, 2.0)
+
+class ModificationJournalTests(unittest.TestCase):
+
+    def __init__(self, *args, **kwargs):
+        super(ModificationJournalTests, self).__init__(*args, **kwargs)
+        self.original_filename = 'tests/test_model.urdf'
+        self.original_robot, _ = utils.load_robot_and_gazebo_plugins(self.original_filename)
+
+    def setUp(self):
+        self.modified_robot = copy.deepcopy(self.original_robot)
+
+    def to_bytes(self, robot):
+        stream = io.BytesIO()
+        utils.write_urdf_to_stream(robot, stream, path='')
+        return stream.getvalue()
+
+    def modify_robot(self):
+        modification = Modification()
+        modification.add_dimension(2, absolute=False)
+        modification.add_density(3, absolute=False)
+        FixedOffsetModifier.from_name('non_aligned_link', self.modified_robot).modify(modification)
+        radius_modification = Modification()
+        radius_modification.add_radius(2, absolute=False)
+        LinkModifier.from_name('aligned_link', self.modified_robot).modify(radius_modification)
+        joint_modification = Modification()
+        joint_modification.add_joint_type(geometry.JointType.REVOLUTE)
+        JointModifier.from_name('aligned_link_joint_after', self.modified_robot).modify(joint_modification)
+
+    def test_rollback_restores_original_robot(self):
+        original_bytes = self.to_bytes(self.modified_robot)
+        journal = ModificationJournal(self.modified_robot)
+        pose_cache = PoseCache(self.modified_robot)
+        pose_cache.get_link_poses()
+
+        self.modify_robot()
+        self.assertNotEqual(self.to_bytes(self.modified_robot), original_bytes)
+        self.assertIn((self.modified_robot.links[3], geometry.ElementField.VISUAL_GEOMETRY), journal.touched)
+        journal.rollback()
+
+        self.assertEqual(self.to_bytes(self.modified_robot), original_bytes)
+        self.assertEqual(len(journal), 0)
+        link_poses = self.modified_robot.link_fk()
+        for link in self.modified_robot.links:
+            np.testing.assert_allclose(pose_cache.get_link_pose(link.name), link_poses[link])
+        pose_cache.detach()
+        journal.detach()
+
+    def test_transaction_is_rolled_back_unless_committed(self):
+        original_bytes = self.to_bytes(self.modified_robot)
+        with robot_transaction(self.modified_robot):
+            self.modify_robot()
+        self.assertEqual(self.to_bytes(self.modified_robot), original_bytes)
+
+        with robot_transaction(self.modified_robot) as journal:
+            self.modify_robot()
+            journal.commit()
+        self.assertNotEqual(self.to_bytes(self.modified_robot), original_bytes)
+
+    def test_undetached_observers_do_not_keep_robot_alive(self):
+        robot_ref = weakref.ref(self.modified_robot)
+        journal = ModificationJournal(self.modified_robot)
+        PoseCache.of(self.modified_robot).get_link_poses()
+        MassPropertiesTracker.of(self.modified_robot)
+        self.modify_robot()
+        self.assertTrue(journal.touched)
+
+        del journal
+        self.modified_robot = None
+        gc.collect()
+        self.assertIsNone(robot_ref())
+
+    def test_collected_observers_are_not_notified(self):
+        observed_joint = self.modified_robot.joint_map['aligned_link_joint_after']
+        journal = ModificationJournal(self.modified_robot)
+        journal_ref = weakref.ref(journal)
+        del journal
+        gc.collect()
+
+        self.assertIsNone(journal_ref())
+        self.modify_robot()
+        self.assertEqual(_element_observers[observed_joint], [])
+
+class EvaluationTests(unittest.TestCase):
+
+    def __init__(self, *args, **kwargs):
+        super(EvaluationTests, self).__init__(*args, **kwargs)
+        self.original_filename = 'tests/test_model.urdf'
+        self.original_robot, _ = utils.load_robot_and_gazebo_plugins(self.original_filename)
+
+    def setUp(self):
+        self.modified_robot = copy.deepcopy(self.original_robot)
+        self.modification = Modification()
+        self.modification.add_dimension(2, absolute=False)
+        self.modification.add_density(3, absolute=False)
+
+    def to_bytes(self, robot):
+        stream = io.BytesIO()
+        utils.write_urdf_to_stream(robot, stream, path='')
+        return stream.getvalue()
+
+    def test_link_evaluation_matches_modification(self):
+        original_bytes = self.to_bytes(self.modified_robot)
+        link_evaluation = LinkModifier.from_name('non_aligned_link', self.modified_robot, Side.Z).evaluate(self.modification)
+        offset_evaluation = FixedOffsetModifier.from_name('non_aligned_link', self.modified_robot).evaluate(self.modification)
+        self.assertEqual(self.to_bytes(self.modified_robot), original_bytes)
+
+        link_robot = copy.deepcopy(self.original_robot)
+        LinkModifier.from_name('non_aligned_link', link_robot, Side.Z).modify(self.modification)
+        self.assertEqual(link_evaluation.mass, link_robot.links[3].inertial.mass)
+        np.testing.assert_allclose(link_evaluation.inertia, link_robot.links[3].inertial.inertia)
+        FixedOffsetModifier.from_name('non_aligned_link', self.modified_robot).modify(self.modification)
+        np.testing.assert_allclose(offset_evaluation.visual_origin, self.modified_robot.links[3].visuals[0].origin)
+        np.testing.assert_allclose(offset_evaluation.joint_origins['non_aligned_link_joint_after'], self.modified_robot.joints[3].origin)
+
+    def test_plan_evaluation_matches_application(self):
+        plan = ModificationPlan.from_modifications({'aligned_link': self.modification, 'non_aligned_link': self.modification}, keep_offsets=True)
+        original_bytes = self.to_bytes(self.modified_robot)
+        robot_evaluation = plan.evaluate(self.modified_robot)
+        self.assertEqual(self.to_bytes(self.modified_robot), original_bytes)
+
+        plan.apply(self.modified_robot)
+        expected_evaluation = RobotEvaluation.from_robot(self.modified_robot)
+        np.testing.assert_allclose(robot_evaluation.masses, expected_evaluation.masses)
+        np.testing.assert_allclose(robot_evaluation.inertias, expected_evaluation.inertias)
+        np.testing.assert_allclose(robot_evaluation.joint_origins, expected_evaluation.joint_origins)
+        stacked_evaluation = RobotEvaluation.stack([robot_evaluation, expected_evaluation])
+        self.assertEqual(stacked_evaluation.visual_origins.shape, (2, 5, 4, 4))
+
+class ModificationFusionTests(unittest.TestCase):
+
+    def __init__(self, *args, **kwargs):
+        super(ModificationFusionTests, self).__init__(*args, **kwargs)
+        self.original_filename = 'tests/test_model.urdf'
+        self.original_robot, _ = utils.load_robot_and_gazebo_plugins(self.original_filename)
+
+    def setUp(self):
+        self.modified_robot = copy.deepcopy(self.original_robot)
+        self.expected_robot = copy.deepcopy(self.original_robot)
+        self.changes = []
+
+    def on_element_change(self, element, field):
+        self.changes.append((element.name, field))
+
+    def get_modifications(self, *fields):
+        modifications = []
+        for field, value, absolute in fields:
+            modification = Modification()
+            getattr(modification, field)(value, absolute)
+            modifications.append(modification)
+        return modifications
+
+    def assert_robots_equal(self):
+        for link, expected_link in zip(self.modified_robot.links, self.expected_robot.links):
+            self.assertAlmostEqual(link.inertial.mass, expected_link.inertial.mass)
+            np.testing.assert_allclose(link.inertial.inertia, expected_link.inertial.inertia)
+            np.testing.assert_allclose(link.visuals[0].origin, expected_link.visuals[0].origin, atol=1e-12)
+            for collision, expected_collision in zip(link.collisions, expected_link.collisions):
+                np.testing.assert_allclose(collision.origin, expected_collision.origin, atol=1e-12)
+        for joint, expected_joint in zip(self.modified_robot.joints, self.expected_robot.joints):
+            np.testing.assert_allclose(joint.origin, expected_joint.origin, atol=1e-12)
+            self.assertEqual(joint.joint_type, expected_joint.joint_type)
+
+    def test_link_modifications_are_fused(self):
+        modifications = self.get_modifications(('add_dimension', 2, False), ('add_density', 3, False), ('add_mass', 4, True),
+                                               ('add_mass', 0.5, False), ('add_position', 0.1, True), ('add_dimension', 1.5, False))
+        for modification in modifications:
+            LinkModifier.from_name('non_aligned_link', self.expected_robot, Side.Z).modify(modification)
+        modifier = LinkModifier.from_name('non_aligned_link', self.modified_robot, Side.Z)
+        attach_observer(modifier.element, self)
+        modifier.modify_all(modifications)
+
+        self.assert_robots_equal()
+        self.assertEqual([field for _, field in self.changes].count(geometry.ElementField.INERTIA), 1)
+        self.assertEqual([field for _, field in self.changes].count(geometry.ElementField.MASS), 1)
+
+    def test_fixed_offset_modifications_are_fused(self):
+        modifications = self.get_modifications(('add_density', 2, False), ('add_dimension', 2, False), ('add_radius', 3, False),
+                                               ('add_dimension', 0.5, True), ('add_mass', 1.5, False))
+        for link_name, link_modifications in [('non_aligned_link', modifications[:2] + modifications[3:]), ('connector_link_1', modifications)]:
+            for modification in link_modifications:
+                FixedOffsetModifier.from_name(link_name, self.expected_robot).modify(modification)
+            FixedOffsetModifier.from_name(link_name, self.modified_robot).modify_all(link_modifications)
+
+        self.assert_robots_equal()
+
+    def test_clamped_inertia_modifications_are_fused(self):
+        modifications = self.get_modifications(('add_radius', 0.5, False), ('add_mass', 10, True))
+        for modification in modifications:
+            FixedOffsetModifier.from_name('aligned_link', self.expected_robot).modify(modification)
+        FixedOffsetModifier.from_name('aligned_link', self.modified_robot).modify_all(modifications)
+
+        self.assert_robots_equal()
+
+    def test_fixed_offset_links_are_modified_in_one_pass(self):
+        link_modifications = [('connector_link_1', self.get_modifications(('add_dimension', 2, False))[0]),
+                              ('aligned_link', self.get_modifications(('add_dimension', 0.5, False))[0]),
+                              ('non_aligned_link', self.get_modifications(('add_mass', 2, False))[0]),
+                              ('aligned_link', self.get_modifications(('add_density', 3, False))[0]),
+                              ('non_aligned_link', self.get_modifications(('add_dimension', 1.5, False))[0])]
+        for link_name, modification in link_modifications:
+            FixedOffsetModifier.from_name(link_name, self.expected_robot).modify(modification)
+        for element in self.modified_robot.joints:
+            attach_observer(element, self)
+        FixedOffsetModifier.modify_links(self.modified_robot, link_modifications)
+
+        self.assert_robots_equal()
+        joint_changes = [name for name, field in self.changes if field == geometry.ElementField.JOINT_ORIGIN]
+        self.assertEqual(sorted(joint_changes), ['aligned_link_joint_after', 'non_aligned_link_joint_after', 'non_aligned_link_joint_before'])
+
+    def test_fixed_offset_links_order_does_not_matter(self):
+        link_modifications = [('aligned_link', self.get_modifications(('add_dimension', 2, False))[0]),
+                              ('connector_link_1', self.get_modifications(('add_dimension', 0.5, False))[0]),
+                              ('non_aligned_link', self.get_modifications(('add_dimension', 3, False))[0])]
+        FixedOffsetModifier.modify_links(self.expected_robot, link_modifications)
+        FixedOffsetModifier.modify_links(self.modified_robot, reversed(link_modifications))
+
+        self.assert_robots_equal()
+
+    def test_fixed_offset_links_with_mixed_offset_masks(self):
+        mixed_modifications = self.get_modifications(('add_dimension', 2, False), ('add_dimension', 1.5, False))
+        mixed_modifications[1].add_offset_mask([1, 1, 0])
+        link_modifications = [('aligned_link', mixed_modifications[0]), ('non_aligned_link', mixed_modifications[0]),
+                              ('aligned_link', mixed_modifications[1])]
+        for link_name, modification in link_modifications:
+            FixedOffsetModifier.from_name(link_name, self.expected_robot).modify(modification)
+        FixedOffsetModifier.modify_links(self.modified_robot, link_modifications)
+
+        self.assert_robots_equal()
+        plan_robot = copy.deepcopy(self.original_robot)
+        ModificationPlan([ModificationStep(link_name, modification) for link_name, modification in link_modifications], keep_offsets=True).apply(plan_robot)
+        self.modified_robot = plan_robot
+        self.assert_robots_equal()
+
+    def apply_steps_in_order(self, steps):
+        for step in steps:
+            if step.element_name.endswith('joint_after'):
+                JointModifier.from_name(step.element_name, self.expected_robot, Side.Z).modify(step.modification)
+            else:
+                FixedOffsetModifier.from_name(step.element_name, self.expected_robot).modify(step.modification)
+
+    def test_plan_applies_joint_step_before_following_link_step(self):
+        joint_modification, link_modification = self.get_modifications(('add_position', 4, True), ('add_dimension', 2, False))
+        steps = [ModificationStep('aligned_link_joint_after', joint_modification), ModificationStep('aligned_link', link_modification)]
+        ModificationPlan(steps, keep_offsets=True).apply(self.modified_robot)
+        self.apply_steps_in_order(steps)
+
+        self.assert_robots_equal()
+        self.assertEqual(self.modified_robot.joints[1].origin[2, 3], 6)
+
+    def test_plan_keeps_order_of_interleaved_steps(self):
+        joint_modification, link_modification = self.get_modifications(('add_position', 4, True), ('add_dimension', 2, False))
+        steps = [ModificationStep('aligned_link', link_modification), ModificationStep('aligned_link_joint_after', joint_modification),
+                 ModificationStep('non_aligned_link', link_modification), ModificationStep('aligned_link', link_modification)]
+        plan = ModificationPlan(steps, keep_offsets=True)
+        plan.apply(self.modified_robot)
+        self.apply_steps_in_order(steps)
+
+        self.assert_robots_equal()
+        self.assertEqual(len(plan.segments), 2)
+
+    def test_plan_fuses_limb_and_link_sections(self):
+        config = configparser.ConfigParser()
+        config.read_string("[arms]\ndimension_scale = 2.0\ndensity_scale = 2.0\n[non_aligned_link]\nmass_scale = 3.0\ndimension = 0.5\n")
+        selectors = {Limb.ARMS: ['non_aligned_link', 'aligned_link']}
+        ModificationPlan.compile(config, selectors=selectors, keep_offsets=True).apply(self.modified_robot)
+        for section_name in config.sections():
+            for link_name in ModificationPlan.resolve_section(section_name, selectors):
+                FixedOffsetModifier.from_name(link_name, self.expected_robot).modify(Modification.from_config_section(config[section_name]))
+
+        self.assert_robots_equal()
+
+class PatchTests(unittest.TestCase):
+
+    def __init__(self, *args, **kwargs):
+        super(PatchTests, self).__init__(*args, **kwargs)
+        self.original_filename = 'tests/test_model.urdf'
+        self.original_robot, _ = utils.load_robot_and_gazebo_plugins(self.original_filename)
+
+    def setUp(self):
+        self.modified_robot = copy.deepcopy(self.original_robot)
+        self.base_robot = copy.deepcopy(self.original_robot)
+        self.journal = ModificationJournal(self.modified_robot)
+        modification = Modification()
+        modification.add_dimension(2, absolute=False)
+        modification.add_density(3, absolute=False)
+        FixedOffsetModifier.from_name('aligned_link', self.modified_robot).modify(modification)
+        joint_modification = Modification()
+        joint_modification.add_joint_type(geometry.JointType.FIXED)
+        JointModifier.from_name('non_aligned_link_joint_after', self.modified_robot).modify(joint_modification)
+
+    def test_patch_holds_only_touched_elements(self):
+        robot_patch = patch.create_patch(self.journal.touched, self.modified_robot.name)
+
+        self.assertEqual(list(robot_patch['links']), ['aligned_link'])
+        self.assertEqual(sorted(robot_patch['joints']), ['aligned_link_joint_after', 'non_aligned_link_joint_after'])
+        self.assertEqual(robot_patch['joints']['non_aligned_link_joint_after']['joint_type'], 'fixed')
+
+    def test_apply_patch_reproduces_the_variant(self):
+        with tempfile.TemporaryDirectory() as out_dir:
+            patch_filename = os.path.join(out_dir, 'variant.json')
+            patch.write_patch_to_file(patch.create_patch(self.journal.touched), patch_filename)
+            patch.apply_patch(self.base_robot, patch.load_patch_from_file(patch_filename))
+
+        for link, patched_link in zip(self.modified_robot.links, self.base_robot.links):
+            self.assertAlmostEqual(link.inertial.mass, patched_link.inertial.mass)
+            np.testing.assert_allclose(link.inertial.inertia, patched_link.inertial.inertia)
+            np.testing.assert_allclose(link.visuals[0].origin, patched_link.visuals[0].origin)
+            self.assertEqual(link.visuals[0].geometry.cylinder is None, patched_link.visuals[0].geometry.cylinder is None)
+        self.assertEqual(self.base_robot.links[1].visuals[0].geometry.cylinder.length, self.modified_robot.links[1].visuals[0].geometry.cylinder.length)
+        for joint, patched_joint in zip(self.modified_robot.joints, self.base_robot.joints):
+            np.testing.assert_allclose(joint.origin, patched_joint.origin)
+            self.assertEqual(joint.joint_type, patched_joint.joint_type)
+
+    def test_apply_patch_can_be_rolled_back(self):
+        robot_patch = patch.create_patch(self.journal.touched)
+        with robot_transaction(self.base_robot):
+            patch.apply_patch(self.base_robot, robot_patch)
+            self.assertEqual(self.base_robot.joints[3].joint_type, 'fixed')
+
+        self.assertEqual(self.base_robot.joints[3].joint_type, self.original_robot.joints[3].joint_type)
+        np.testing.assert_allclose(self.base_robot.joints[1].origin, self.original_robot.joints[1].origin)
+
+class DocumentTests(unittest.TestCase):
+
+    def __init__(self, *args, **kwargs):
+        super(DocumentTests, self).__init__(*args, **kwargs)
+        self.original_filename = 'tests/test_model.urdf'
+        with open(self.original_filename, 'rb') as f:
+            original_bytes = f.read()
+        closing_tag_position = original_bytes.rindex(b'</robot>')
+        self.original_bytes = (original_bytes[:closing_tag_position] + b'  <!-- simulation -->\n'
+                               + b'  <gazebo reference="aligned_link">\n    <selfCollide>true</selfCollide>\n  </gazebo>\n'
+                               + original_bytes[closing_tag_position:])
+
+    def setUp(self):
+        self.document = document.UrdfDocument.from_bytes(self.original_bytes)
+
+    def modify(self, robot):
+        modification = Modification()
+        modification.add_dimension(2, absolute=False)
+        modification.add_mass(3, absolute=True)
+        FixedOffsetModifier.from_name('aligned_link', robot).modify(modification)
+        joint_modification = Modification()
+        joint_modification.add_joint_type(geometry.JointType.FIXED)
+        JointModifier.from_name('non_aligned_link_joint_after', robot).modify(joint_modification)
+
+    def test_saved_document_is_collected(self):
+        robot_ref = weakref.ref(self.document.robot)
+        self.modify(self.document.robot)
+        self.document.to_bytes()
+
+        self.document = None
+        gc.collect()
+        self.assertIsNone(robot_ref())
+
+    def test_untouched_document_is_saved_unchanged(self):
+        saved_bytes = self.document.to_bytes()
+
+        self.assertIn(b'<!-- simulation -->', saved_bytes)
+        self.assertEqual(saved_bytes.split(b'<robot', 1)[1].rstrip(), self.original_bytes.split(b'<robot', 1)[1].rstrip())
+
+    def test_only_touched_elements_are_written(self):
+        self.modify(self.document.robot)
+        saved_bytes = self.document.to_bytes()
+
+        original_lines = self.original_bytes.decode().splitlines()
+        saved_lines = saved_bytes.decode().splitlines()[1:]
+        self.assertEqual(len(saved_lines), len(original_lines) - 1)
+        changed_lines = [line for line, original_line in zip(saved_lines, original_lines[1:]) if line != original_line]
+        self.assertEqual(len(changed_lines), 8)
+        self.assertIn(b'<selfCollide>true</selfCollide>', saved_bytes)
+
+    def test_saved_document_matches_modified_robot(self):
+        self.modify(self.document.robot)
+        expected_robot, _ = utils.load_robot_and_gazebo_plugins(self.original_filename)
+        self.modify(expected_robot)
+        with tempfile.TemporaryDirectory() as out_dir:
+            filename = os.path.join(out_dir, 'model.urdf')
+            self.document.save(filename)
+            saved_robot, gazebo_blocks = utils.load_robot_and_gazebo_plugins(filename)
+
+        self.assertEqual(len(gazebo_blocks), 1)
+        for link, expected_link in zip(saved_robot.links, expected_robot.links):
+            self.assertAlmostEqual(link.inertial.mass, expected_link.inertial.mass)
+            np.testing.assert_allclose(link.inertial.inertia, expected_link.inertial.inertia)
+            np.testing.assert_allclose(link.visuals[0].origin, expected_link.visuals[0].origin, atol=1e-12)
+        for joint, expected_joint in zip(saved_robot.joints, expected_robot.joints):
+            np.testing.assert_allclose(joint.origin, expected_joint.origin, atol=1e-12)
+            self.assertEqual(joint.joint_type, expected_joint.joint_type)
+
+class VariantsTests(unittest.TestCase):
+
+    def __init__(self, *args, **kwargs):
+        super(VariantsTests, self).__init__(*args, **kwargs)
+        self.original_filename = 'tests/test_model.urdf'
+
+    def setUp(self):
+        self.out_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.out_dir)
+
+    def get_modification_sets(self):
+        modification_sets = []
+        for mass in [1.0, 2.0, 3.0]:
+            modification = Modification()
+            modification.add_mass(mass, absolute=True)
+            modification_sets.append({'aligned_link': modification})
+        modification_sets.insert(1, {'missing_link': modification})
+        return modification_sets
+
+    def check_results(self, results):
+        self.assertEqual([result.index for result in results], [0, 1, 2, 3])
+        self.assertIsNotNone(results[1].error)
+        for result, mass in zip([results[0], results[2], results[3]], [1.0, 2.0, 3.0]):
+            self.assertIsNone(result.error)
+            robot, _ = utils.load_robot_and_gazebo_plugins(result.path)
+            self.assertEqual(robot.links[1].inertial.mass, mass)
+
+    def test_variants_are_generated_in_process(self):
+        template_refs = []
+        def get_modification_sets():
+            for modification_set in self.get_modification_sets():
+                template_refs.append(weakref.ref(variants._template[0]))
+                yield modification_set
+
+        self.check_results(variants.generate_variants(self.original_filename, get_modification_sets(), self.out_dir, workers=1))
+        gc.collect()
+        self.assertIsNone(template_refs[0]())
+
+    def test_variants_are_generated_by_workers(self):
+        self.check_results(variants.generate_variants(self.original_filename, iter(self.get_modification_sets()), self.out_dir, workers=2))
+
+    def test_variants_are_generated_as_patches(self):
+        results = variants.generate_variants(self.original_filename, self.get_modification_sets(), self.out_dir, workers=1, patch=True)
+
+        self.assertEqual([os.path.basename(results[i].path) for i in [0, 2, 3]], ['variant_0.json', 'variant_2.json', 'variant_3.json'])
+        for result, mass in zip([results[0], results[2], results[3]], [1.0, 2.0, 3.0]):
+            robot_patch = patch.load_patch_from_file(result.path)
+            self.assertEqual(list(robot_patch['links']), ['aligned_link'])
+            self.assertEqual(robot_patch['links']['aligned_link']['mass'], mass)
+            self.assertEqual(robot_patch['joints'], {})
+
+    def test_variants_are_evaluated_without_writing(self):
+        results = variants.evaluate_variants(self.original_filename, self.get_modification_sets(), workers=2)
+
+        self.assertEqual([result.index for result in results], [0, 1, 2, 3])
+        self.assertIsNotNone(results[1].error)
+        self.assertEqual([results[i].evaluation.masses[1] for i in [0, 2, 3]], [1.0, 2.0, 3.0])
+        self.assertEqual(os.listdir(self.out_dir), [])
+
+class VariantCacheTests(unittest.TestCase):
+
+    def __init__(self, *args, **kwargs):
+        super(VariantCacheTests, self).__init__(*args, **kwargs)
+        self.original_filename = 'tests/test_model.urdf'
+        with open(self.original_filename, 'rb') as f:
+            self.original_bytes = f.read()
+
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.cache_dir)
+
+    def get_modification_set(self, dimension, offset_mask=None):
+        modification = Modification()
+        modification.add_dimension(dimension, absolute=False, offset_mask=offset_mask)
+        return {'aligned_link': modification}
+
+    def test_key_depends_on_modifications_and_modifier_type(self):
+        key = cache.VariantCache.get_key(self.original_bytes, self.get_modification_set(2.0))
+
+        self.assertEqual(key, cache.VariantCache.get_key(self.original_bytes, self.get_modification_set(2)))
+        self.assertNotEqual(key, cache.VariantCache.get_key(self.original_bytes, self.get_modification_set(2.0, [1, 1, 0])))
+        self.assertNotEqual(key, cache.VariantCache.get_key(self.original_bytes, ModificationPlan.from_modifications(self.get_modification_set(2.0), keep_offsets=True)))
+        self.assertNotEqual(key, cache.VariantCache.get_key(self.original_bytes, self.get_modification_set(2.0), patch=True))
+        self.assertNotEqual(key, cache.VariantCache.get_key(self.original_bytes + b' ', self.get_modification_set(2.0)))
+
+    def test_cached_variants_are_not_generated_again(self):
+        variant_cache = cache.VariantCache(self.cache_dir)
+        urdf_bytes = variant_cache.get_or_generate(self.original_filename, self.get_modification_set(2.0))
+        patch_bytes = variant_cache.get_or_generate(self.original_filename, self.get_modification_set(2.0), patch=True)
+
+        self.assertEqual(variant_cache.get_or_generate(self.original_filename, self.get_modification_set(2.0)), urdf_bytes)
+        self.assertEqual((variant_cache.hits, variant_cache.misses), (1, 2))
+        robot = utils.load_robot_from_bytes(urdf_bytes)
+        self.assertEqual(robot.links[1].visuals[0].geometry.cylinder.length, 4)
+        patched_robot = patch.apply_patch(utils.load_robot_from_bytes(self.original_bytes), json.loads(patch_bytes))
+        self.assertEqual(patched_robot.links[1].visuals[0].geometry.cylinder.length, 4)
+        shared_cache = cache.VariantCache(self.cache_dir, max_memory_bytes=0)
+        self.assertEqual(shared_cache.get_or_generate(self.original_filename, self.get_modification_set(2.0)), urdf_bytes)
+        self.assertEqual((shared_cache.hits, shared_cache.misses), (1, 0))
+
+    def test_generation_leaves_no_observers(self):
+        variant_cache = cache.VariantCache(self.cache_dir)
+        gc.collect()
+        observed_elements = len(_element_observers)
+        variant_cache.get_or_generate(self.original_filename, self.get_modification_set(2.0), patch=True)
+        variant_cache.get_or_generate(self.original_filename, self.get_modification_set(3.0))
+
+        gc.collect()
+        self.assertEqual(len(_element_observers), observed_elements)
+
+    def test_least_recently_used_variants_are_evicted(self):
+        variant_cache = cache.VariantCache(self.cache_dir)
+        keys = [variant_cache.get_key(self.original_bytes, self.get_modification_set(dimension)) for dimension in [1.0, 2.0, 3.0]]
+        variant_cache.put(keys[0], b'0' * 100)
+        variant_cache.put(keys[1], b'1' * 100)
+        os.utime(variant_cache.get_path(keys[0]), (1, 1))
+        os.utime(variant_cache.get_path(keys[1]), (2, 2))
+        variant_cache.max_bytes = 250
+        variant_cache.put(keys[2], b'2' * 100)
+
+        self.assertIsNone(variant_cache.get(keys[0]))
+        self.assertEqual(variant_cache.get(keys[1]), b'1' * 100)
+        self.assertEqual(variant_cache.get(keys[2]), b'2' * 100)
+        self.assertEqual(variant_cache.disk_bytes, 200)
+
+    def test_disk_accounting_ignores_overwrites_and_temporary_files(self):
+        variant_cache = cache.VariantCache(self.cache_dir)
+        key = variant_cache.get_key(self.original_bytes, self.get_modification_set(2.0))
+        variant_cache.put(key, b'0' * 100)
+        variant_cache.put(key, b'1' * 100)
+        temporary_path = variant_cache.get_path(key) + '.0.tmp'
+        with open(temporary_path, 'wb') as f:
+            f.write(b'2' * 1000)
+        variant_cache.max_bytes = 150
+        variant_cache.evict()
+
+        self.assertEqual(variant_cache.disk_bytes, 100)
+        self.assertTrue(os.path.exists(temporary_path))
+        self.assertEqual(variant_cache.get(key), b'1' * 100)
+
+    def test_memory_hits_refresh_last_use(self):
+        variant_cache = cache.VariantCache(self.cache_dir)
+        key = variant_cache.get_key(self.original_bytes, self.get_modification_set(2.0))
+        variant_cache.put(key, b'0' * 100)
+        os.utime(variant_cache.get_path(key), (1, 1))
+
+        self.assertEqual(variant_cache.get(key), b'0' * 100)
+        self.assertGreater(os.stat(variant_cache.get_path(key)).st_mtime, 1)
+
+    def test_generation_does_not_export_template_meshes(self):
+        with tempfile.TemporaryDirectory() as model_dir:
+            template = os.path.join(model_dir, 'model.urdf')
+            with open(template, 'wb') as f:
+                f.write(add_mesh_link(self.original_bytes, model_dir))
+            mesh_path = os.path.join(model_dir, 'meshes', 'box.stl')
+            os.utime(mesh_path, (1, 1))
+            urdf_bytes = cache.VariantCache(self.cache_dir).get_or_generate(template, self.get_modification_set(2.0))
+
+            self.assertEqual(os.stat(mesh_path).st_mtime, 1)
+            self.assertEqual(sorted(os.listdir(model_dir)), ['meshes', 'model.urdf'])
+        self.assertIn(b'<mesh filename="meshes/box.stl"/>', urdf_bytes)
+
+def add_mesh_link(urdf_bytes, directory):
+    """Returns the URDF content with a link whose visual and collision are a mesh, attached below connector_link_2.
+    The mesh is written to directory/meshes/box.stl"""
+    os.makedirs(os.path.join(directory, 'meshes'))
+    trimesh.creation.box([0.2, 0.2, 0.2]).export(os.path.join(directory, 'meshes', 'box.stl'))
+    mesh_link = (b'  <link name="mesh_link">\n'
+                 b'    <visual>\n      <geometry>\n        <mesh filename="meshes/box.stl"/>\n      </geometry>\n    </visual>\n'
+                 b'    <collision>\n      <geometry>\n        <mesh filename="meshes/box.stl"/>\n      </geometry>\n    </collision>\n'
+                 b'    <inertial>\n      <mass value="1"/>\n      <inertia ixx="0.1" ixy="0.0" ixz="0.0" iyy="0.1" iyz="0.0" izz="0.1"/>\n    </inertial>\n'
+                 b'  </link>\n'
+                 b'  <joint name="mesh_link_joint" type="fixed">\n    <parent link="connector_link_2"/>\n    <child link="mesh_link"/>\n'
+                 b'    <origin xyz="0 0 1"/>\n  </joint>\n')
+    closing_tag_position = urdf_bytes.rindex(b'</robot>')
+    return urdf_bytes[:closing_tag_position] + mesh_link + urdf_bytes[closing_tag_position:]
+
+class UtilsTests(unittest.TestCase):
+
+    def __init__(self, *args, **kwargs):
+        super(UtilsTests, self).__init__(*args, **kwargs)
+        self.original_filename = 'tests/test_model.urdf'
+        with open(self.original_filename, 'rb') as f:
+            self.original_bytes = f.read()
+        self.gazebo_block = b'  <gazebo reference="aligned_link">\n    <selfCollide>true</selfCollide>\n  </gazebo>\n'
+        closing_tag_position = self.original_bytes.rindex(b'</robot>')
+        self.bytes_with_plugins = self.original_bytes[:closing_tag_position] + self.gazebo_block + self.original_bytes[closing_tag_position:]
+
+    def test_clone_robot_copies_only_modifiable_fields(self):
+        robot, _ = utils.load_robot_and_gazebo_plugins('tests/test_model.urdf')
+        cloned_robot = utils.clone_robot(robot)
+
+        self.assertIsNot(cloned_robot.links[1], robot.links[1])
+        self.assertIs(cloned_robot.links[1].visuals[0].material, robot.links[1].visuals[0].material)
+        modifier = FixedOffsetModifier.from_name('aligned_link', cloned_robot)
+        modification = Modification()
+        modification.add_dimension(2, absolute=False)
+        modification.add_mass(5, absolute=True)
+        modifier.modify(modification)
+        original_robot, _ = utils.load_robot_and_gazebo_plugins('tests/test_model.urdf')
+        original_stream, robot_stream = io.BytesIO(), io.BytesIO()
+        utils.write_urdf_to_stream(original_robot, original_stream, path='')
+        utils.write_urdf_to_stream(robot, robot_stream, path='')
+        self.assertEqual(robot_stream.getvalue(), original_stream.getvalue())
+        self.assertEqual(cloned_robot.links[1].inertial.mass, 5)
+
+    def test_clone_robot_copies_every_element(self):
+        robot, _ = utils.load_robot_and_gazebo_plugins('tests/test_model.urdf')
+        cloned_robot = utils.clone_robot(robot)
+
+        for link, cloned_link in zip(robot.links, cloned_robot.links):
+            self.assertIsNot(cloned_link, link)
+            self.assertIsNot(cloned_link.inertial, link.inertial)
+            self.assertIsNot(cloned_link.visuals[0].geometry, link.visuals[0].geometry)
+        for joint, cloned_joint in zip(robot.joints, cloned_robot.joints):
+            self.assertIsNot(cloned_joint, joint)
+        modification = Modification()
+        modification.add_joint_type(geometry.JointType.REVOLUTE)
+        JointModifier.from_name('aligned_link_joint_before', cloned_robot).modify(modification)
+        self.assertEqual(robot.joints[0].joint_type, 'fixed')
+
+    def test_clone_robot_structure_uses_cloned_elements(self):
+        robot, _ = utils.load_robot_and_gazebo_plugins('tests/test_model.urdf')
+        cloned_robot = utils.clone_robot(robot)
+        modification = Modification()
+        modification.add_dimension(2, absolute=False)
+        FixedOffsetModifier.from_name('aligned_link', cloned_robot).modify(modification)
+
+        link_poses = cloned_robot.link_fk()
+        self.assertEqual(set(link_poses), set(cloned_robot.links))
+        self.assertEqual(link_poses[cloned_robot.link_map['connector_link_1']][2, 3], 5)
+        self.assertIs(cloned_robot.base_link, cloned_robot.links[0])
+        self.assertEqual([link.name for link in cloned_robot.end_links], [link.name for link in robot.end_links])
+        for joint in cloned_robot.joints:
+            self.assertIs(cloned_robot._G.edges[cloned_robot.link_map[joint.child], cloned_robot.link_map[joint.parent]]['joint'], joint)
+        self.assertEqual(robot.link_fk()[robot.link_map['connector_link_1']][2, 3], 3)
+
+    def test_gazebo_plugins_are_split_in_memory(self):
+        robot_bytes, gazebo_blocks = utils.split_gazebo_plugins(self.bytes_with_plugins)
+
+        self.assertEqual(robot_bytes, self.original_bytes)
+        self.assertEqual(gazebo_blocks, [self.gazebo_block])
+
+    def test_robot_is_loaded_from_bytes(self):
+        robot, gazebo_blocks = utils.load_robot_and_gazebo_plugins_from_bytes(self.bytes_with_plugins)
+        original_robot, _ = utils.load_robot_and_gazebo_plugins(self.original_filename)
+
+        self.assertEqual([link.name for link in robot.links],
+                         [link.name for link in original_robot.links])
+        self.assertEqual(gazebo_blocks, [self.gazebo_block])
+
+    def test_gazebo_plugins_are_written_before_closing_tag(self):
+        robot, gazebo_blocks = utils.load_robot_and_gazebo_plugins_from_bytes(self.bytes_with_plugins)
+        stream = io.BytesIO()
+
+        utils.write_urdf_to_stream(robot, stream, gazebo_blocks)
+
+        written_bytes = stream.getvalue()
+        self.assertTrue(written_bytes.endswith(self.gazebo_block + b'</robot>\n'))
+        self.assertEqual(written_bytes.count(b'<gazebo'), 1)
+
+    def test_compressed_stream_matches_plain_stream(self):
+        robot, gazebo_blocks = utils.load_robot_and_gazebo_plugins_from_bytes(self.bytes_with_plugins)
+        plain_stream = io.BytesIO()
+        compressed_stream = io.BytesIO()
+
+        utils.write_urdf_to_stream(robot, plain_stream, gazebo_blocks)
+        utils.write_urdf_to_stream(robot, compressed_stream, gazebo_blocks, compress=True)
+
+        self.assertEqual(gzip.decompress(compressed_stream.getvalue()), plain_stream.getvalue())
+
+    def test_streams_without_file_name_do_not_export_meshes(self):
+        with tempfile.TemporaryDirectory() as model_dir, tempfile.TemporaryDirectory() as working_dir:
+            robot = utils.load_robot_from_bytes(add_mesh_link(self.original_bytes, model_dir), model_dir)
+            mesh_mtime = os.stat(os.path.join(model_dir, 'meshes', 'box.stl')).st_mtime_ns
+            current_dir = os.getcwd()
+            os.chdir(working_dir)
+            try:
+                stream = io.BytesIO()
+                utils.write_urdf_to_stream(robot, stream)
+                with tempfile.TemporaryFile() as file_stream:
+                    utils.write_urdf_to_stream(robot, file_stream)
+                    file_stream.seek(0)
+                    self.assertEqual(file_stream.read(), stream.getvalue())
+                self.assertEqual(os.listdir(working_dir), [])
+            finally:
+                os.chdir(current_dir)
+
+            self.assertEqual(os.stat(os.path.join(model_dir, 'meshes', 'box.stl')).st_mtime_ns, mesh_mtime)
+            self.assertEqual(stream.getvalue().count(b'<mesh filename="meshes/box.stl"/>'), 2)
+            written_robot = utils.load_robot_from_bytes(stream.getvalue(), model_dir)
+            self.assertEqual(written_robot.links[-1].visuals[0].geometry.mesh.filename, 'meshes/box.stl')
+
+    def test_file_references_match_urchin_serialization(self):
+        with tempfile.TemporaryDirectory() as model_dir, tempfile.TemporaryDirectory() as out_dir:
+            robot = utils.load_robot_from_bytes(add_mesh_link(self.original_bytes, model_dir), model_dir)
+            texture = Texture('textures/red.png', np.full((2, 2, 3), 255, dtype=np.uint8))
+            robot = URDF(robot.name, robot.links, robot.joints, robot.transmissions, robot.materials + [Material('textured', [1.0, 0.0, 0.0, 1.0], texture)])
+
+            exported_node = robot._to_xml(None, out_dir)
+            referenced_node = utils._robot_to_xml(robot)
+
+            self.assertEqual(sorted(os.listdir(out_dir)), ['meshes', 'textures'])
+            self.assertEqual(etree.tostring(referenced_node), etree.tostring(exported_node))
+
+class RobotIndexTests(unittest.TestCase):
+
+    def __init__(self, *args, **kwargs):
+        super(RobotIndexTests, self).__init__(*args, **kwargs)
+        self.original_filename = 'tests/test_model.urdf'
+        self.original_robot, _ = utils.load_robot_and_gazebo_plugins(self.original_filename)
+
+    def setUp(self):
+        self.modified_robot = copy.deepcopy(self.original_robot)
+        self.robot_index = RobotIndex(self.modified_robot)
+
+    def test_lookups_match_robot_scan(self):
+        for link in self.modified_robot.links:
+            self.assertIs(LinkModifier.get_element_by_name(link.name, self.modified_robot, self.robot_index),
+                          LinkModifier.get_element_by_name(link.name, self.modified_robot))
+        for joint in self.modified_robot.joints:
+            self.assertIs(JointModifier.get_element_by_name(joint.name, self.modified_robot, self.robot_index),
+                          JointModifier.get_element_by_name(joint.name, self.modified_robot))
+        self.assertIsNone(self.robot_index.get_element('missing_element'))
+
+    def test_fixed_offset_modifier_uses_adjacency(self):
+        modifier = FixedOffsetModifier.from_name('aligned_link', self.modified_robot, robot_index=self.robot_index)
+        scanning_modifier = FixedOffsetModifier.from_name('aligned_link', self.modified_robot)
+
+        self.assertIs(modifier.parent_joint, scanning_modifier.parent_joint)
+        self.assertEqual(modifier.child_joint_list, scanning_modifier.child_joint_list)
+
+    def test_index_follows_renamed_and_reparented_joints(self):
+        joint = self.robot_index.get_joint('aligned_link_joint_after')
+
+        self.robot_index.rename_joint(joint, 'renamed_joint')
+        self.robot_index.reparent_joint(joint, parent_link_name='base_link')
+
+        self.assertIsNone(self.robot_index.get_joint('aligned_link_joint_after'))
+        self.assertIs(self.robot_index.get_joint('renamed_joint'), joint)
+        self.assertEqual(self.robot_index.get_child_joints('aligned_link'), [])
+        self.assertIn(joint, self.robot_index.get_child_joints('base_link'))
+        self.assertIs(self.robot_index.get_parent_joint('connector_link_1'), joint)
+
+    def test_invalidated_index_is_rebuilt(self):
+        self.modified_robot.joints[0].name = 'renamed_joint'
+        self.robot_index.invalidate()
+
+        self.assertIs(self.robot_index.get_joint('renamed_joint'), self.modified_robot.joints[0])
+
 if __name__ == '__main__':
     unittest.main()
         
@@ -9,3 +9,11 @@ from . import modification
 from . import linkModifier
 from . import jointModifier
 from . import fixedOffsetModifier
+from . import robotIndex
+from . import inertiaBatch
+from . import parameterVector
+from . import poseCache
+from . import massPropertiesTracker
+from . import modificationPlan
+from . import modificationJournal
+from . import evaluation
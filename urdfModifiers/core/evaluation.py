@@ -0,0 +1,91 @@
+from dataclasses import dataclass, field
+import copy
+import numpy as np
+from urchin import Box, Collision, Cylinder, Geometry, Inertial, Joint, Link, Sphere, Visual
+
+def clone_geometry(geometry:Geometry)-> Geometry:
+    """Returns a copy of the geometry with new box, cylinder and sphere primitives, sharing the mesh"""
+    box = Box(geometry.box.size) if geometry.box is not None else None
+    cylinder = Cylinder(geometry.cylinder.radius, geometry.cylinder.length) if geometry.cylinder is not None else None
+    sphere = Sphere(geometry.sphere.radius) if geometry.sphere is not None else None
+    return Geometry(box, cylinder, sphere, geometry.mesh)
+
+def clone_inertial(inertial:Inertial)-> Inertial:
+    """Returns a copy of the inertial. The inertia was validated when the robot was loaded, so it is copied as is"""
+    inertial_copy = copy.copy(inertial)
+    inertial_copy.origin = inertial.origin
+    inertial_copy._inertia = inertial.inertia.copy()
+    return inertial_copy
+
+def clone_link(link:Link)-> Link:
+    """Returns a copy of the link with its own origins, geometry primitives and inertial, sharing meshes and materials"""
+    inertial = clone_inertial(link.inertial) if link.inertial is not None else None
+    visuals = [Visual(clone_geometry(visual.geometry), visual.name, visual.origin, visual.material) for visual in link.visuals]
+    collisions = [Collision(collision.name, collision.origin, clone_geometry(collision.geometry)) for collision in link.collisions]
+    return Link(link.name, inertial, visuals, collisions)
+
+def clone_joint(joint:Joint)-> Joint:
+    """Returns a copy of the joint with its own origin and type, sharing limits, dynamics and the other attributes"""
+    return Joint(joint.name, joint.joint_type, joint.parent, joint.child, joint.axis, joint.origin,
+                 joint.limit, joint.dynamics, joint.safety_controller, joint.calibration, joint.mimic)
+
+class ShadowRobot():
+    """Class holding the links and joints of a robot, copying only the elements that are going to be modified.
+    It exposes the links and joints lists used by RobotIndex and the modifiers, without building a new URDF.
+    The elements not in element_names are shared with robot, so element_names must hold every element that can be written"""
+    def __init__(self, robot, element_names=None):
+        self.name = robot.name
+        self.links = [clone_link(link) if element_names is None or link.name in element_names else link for link in robot.links]
+        self.joints = [clone_joint(joint) if element_names is None or joint.name in element_names else joint for joint in robot.joints]
+
+@dataclass
+class LinkEvaluation():
+    """Class holding the numeric state of a link, and of the joints moved with it, after a modification"""
+    mass: float
+    inertia: np.ndarray
+    visual_origin: np.ndarray
+    joint_origins: dict = field(default_factory=dict)
+
+    @classmethod
+    def from_link(cls, link, joints=()):
+        """Reads the numeric state of the link and of the given joints"""
+        mass = link.inertial.mass if link.inertial is not None else np.nan
+        inertia = link.inertial.inertia.copy() if link.inertial is not None else np.full((3, 3), np.nan)
+        visual_origin = link.visuals[0].origin.copy() if link.visuals else np.full((4, 4), np.nan)
+        return cls(mass, inertia, visual_origin, {joint.name: joint.origin.copy() for joint in joints})
+
+@dataclass
+class RobotEvaluation():
+    """Class holding the numeric state of every link and joint of a robot as stacked arrays: masses (L,), inertias (L,3,3),
+    visual origins (L,4,4) and joint origins (J,4,4). Links without inertial or visual get NaN values"""
+    link_names: list
+    masses: np.ndarray
+    inertias: np.ndarray
+    visual_origins: np.ndarray
+    joint_names: list
+    joint_origins: np.ndarray
+    joint_types: list
+
+    @classmethod
+    def from_robot(cls, robot):
+        """Reads the numeric state of every link and joint of the robot"""
+        link_evaluations = [LinkEvaluation.from_link(link) for link in robot.links]
+        return cls([link.name for link in robot.links],
+                   np.array([item.mass for item in link_evaluations]),
+                   np.array([item.inertia for item in link_evaluations]).reshape((-1, 3, 3)),
+                   np.array([item.visual_origin for item in link_evaluations]).reshape((-1, 4, 4)),
+                   [joint.name for joint in robot.joints],
+                   np.array([joint.origin for joint in robot.joints]).reshape((-1, 4, 4)),
+                   [joint.joint_type for joint in robot.joints])
+
+    @classmethod
+    def stack(cls, evaluations):
+        """Stacks the evaluations of many variants of the same robot, adding a leading axis to every array"""
+        evaluations = list(evaluations)
+        return cls(evaluations[0].link_names,
+                   np.stack([item.masses for item in evaluations]),
+                   np.stack([item.inertias for item in evaluations]),
+                   np.stack([item.visual_origins for item in evaluations]),
+                   evaluations[0].joint_names,
+                   np.stack([item.joint_origins for item in evaluations]),
+                   [item.joint_types for item in evaluations])
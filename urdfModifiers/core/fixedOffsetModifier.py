@@ -1,10 +1,14 @@
 from dataclasses import dataclass
 from urchin import matrix_to_xyz_rpy
 from math import isclose
+import copy
 import numpy as np
+from urdfModifiers.core.evaluation import LinkEvaluation, clone_joint, clone_link
+from urdfModifiers.core.inertiaBatch import InertiaBatch
 from urdfModifiers.core.jointModifier import JointModifier
 from urdfModifiers.core.linkModifier import LinkModifier
 from urdfModifiers.core.modification import Modification
+from urdfModifiers.core.robotIndex import RobotIndex
 from urdfModifiers.geometry import *
 from urdfModifiers.geometry.geometry import Geometry, Side 
 
@@ -35,6 +39,35 @@ class Offset():
             isclose(self.z, other.z)
         )
 
+class OffsetArray():
+    """Class representing the offsets of many links at once as stacked arrays.
+    Row i of the link arrays refers to the i-th link, row k of the child arrays to the k-th child joint,
+    whose link is given by child_owners[k]"""
+    def __init__(self, link_lengths, link_translations, link_directions, parent_offsets, has_parent_joint, child_offsets, child_owners, child_joints):
+        self.link_lengths = link_lengths
+        self.link_translations = link_translations
+        self.link_directions = link_directions
+        self.parent_offsets = parent_offsets
+        self.has_parent_joint = has_parent_joint
+        self.child_offsets = child_offsets
+        self.child_owners = child_owners
+        self.child_joints = child_joints
+
+    def get_offsets(self, index):
+        """Returns the offsets of the index-th link as Offset objects, in the same form as FixedOffsetModifier.calculate_offsets"""
+        parent_joint_offset = Offset.from_vector(self.parent_offsets[index]) if self.has_parent_joint[index] else None
+        child_joint_offset = [Offset.from_vector(self.child_offsets[k], joint=self.child_joints[k]) for k in np.flatnonzero(self.child_owners == index)]
+        return parent_joint_offset, child_joint_offset
+
+@dataclass
+class FusedOffsetModification():
+    """Class describing the single update equivalent to a list of modifications of a FixedOffsetModifier: the absolute
+    changes of the link (radius, mass), its new length (None if unchanged), the length used to compute the offsets and the offset mask"""
+    link_modification: Modification
+    new_length: float = None
+    original_length: float = None
+    offset_mask: list = None
+
 @dataclass
 class FixedOffsetModifier():
     """
@@ -87,22 +120,56 @@ class FixedOffsetModifier():
     j_o' = s_o + v_l' * j_o - e_o    
     """
 
-    def __init__(self, link, robot, axis=Side.Z):
+    def __init__(self, link, robot, axis=Side.Z, robot_index=None, joint_modifier_map=None):
         self.link = link
         self.link_modifier = LinkModifier(link, axis=axis)
-        parent_joint_list = [corresponding_joint for corresponding_joint in robot.joints if corresponding_joint.child == link.name]
-        self.parent_joint = (parent_joint_list[0] if parent_joint_list else None)
-        self.child_joint_list = [corresponding_joint for corresponding_joint in robot.joints if corresponding_joint.parent == link.name]
-        self.joint_modifier_list = [JointModifier(item, axis = Side.Z) for item in self.child_joint_list]
+        if robot_index is not None:
+            self.parent_joint = robot_index.get_parent_joint(link.name)
+            self.child_joint_list = robot_index.get_child_joints(link.name)
+        else:
+            parent_joint_list = [corresponding_joint for corresponding_joint in robot.joints if corresponding_joint.child == link.name]
+            self.parent_joint = (parent_joint_list[0] if parent_joint_list else None)
+            self.child_joint_list = [corresponding_joint for corresponding_joint in robot.joints if corresponding_joint.parent == link.name]
+        if joint_modifier_map is None:
+            joint_modifier_map = {}
+        for item in self.child_joint_list:
+            if item.name not in joint_modifier_map:
+                joint_modifier_map[item.name] = JointModifier(item, axis = Side.Z)
+        self.joint_modifier_list = [joint_modifier_map[item.name] for item in self.child_joint_list]
 
     @classmethod
-    def from_name(cls, link_name, robot, axis=Side.Z):
+    def from_name(cls, link_name, robot, axis=Side.Z, robot_index=None):
         """Creates an instance of FixedOffsetModifier by passing the robot object and link name"""
-        return cls(FixedOffsetModifier.get_element_by_name(link_name, robot), robot, axis)
+        return cls(FixedOffsetModifier.get_element_by_name(link_name, robot, robot_index), robot, axis, robot_index)
+
+    @classmethod
+    def for_links(cls, link_names, robot, axis=Side.Z, robot_index=None):
+        """Creates the FixedOffsetModifier of every link in link_names, in the same order.
+        The modifiers share a single RobotIndex and the JointModifier of each joint"""
+        if robot_index is None:
+            robot_index = RobotIndex(robot)
+        joint_modifier_map = {}
+        return [cls(robot_index.get_link(link_name), robot, axis, robot_index, joint_modifier_map) for link_name in link_names]
+
+    @classmethod
+    def for_subtree(cls, root_link_name, robot, axis=Side.Z, robot_index=None):
+        """Creates the FixedOffsetModifier of the given link and of every link below it, visiting the tree breadth first.
+        Links without visual elements (e.g. frames) or whose visual is not a basic shape (e.g. meshes) are skipped"""
+        if robot_index is None:
+            robot_index = RobotIndex(robot)
+        link_names = [root_link_name]
+        for link_name in link_names:
+            link_names += [joint.child for joint in robot_index.get_child_joints(link_name)]
+        links = [robot_index.get_link(link_name) for link_name in link_names]
+        link_names = [link.name for link in links if link.visuals and cls.get_geometry(link.visuals[0])[0] is not None]
+        return cls.for_links(link_names, robot, axis, robot_index)
 
     @staticmethod
-    def get_element_by_name(element_name, robot):
-        """Explores the robot looking for the element whose name matches the first argument"""
+    def get_element_by_name(element_name, robot, robot_index=None):
+        """Explores the robot looking for the element whose name matches the first argument.
+        If a RobotIndex is given the lookup is performed on it instead of scanning the robot"""
+        if robot_index is not None:
+            return robot_index.get_element(element_name)
         link_list = [corresponding_link for corresponding_link in robot.links if corresponding_link.name == element_name]
         joint_list = [corresponding_joint for corresponding_joint in robot.joints if corresponding_joint.name == element_name]
         if len(link_list) != 0:
@@ -123,6 +190,7 @@ class FixedOffsetModifier():
             return [geometry.Geometry.CYLINDER, geometry_holder.geometry.cylinder]
         if (geometry_holder.geometry.sphere is not None):
             return [geometry.Geometry.SPHERE, geometry_holder.geometry.sphere]
+        return [None, None]
 
     def get_direction_vector(self):
         """Returns a numpy array corresponding to the relative direction of elongation of the modifier. For spheres and cylinders
@@ -163,9 +231,11 @@ class FixedOffsetModifier():
         return rotation_matrix, translation_vector
 
 
-    def calculate_offsets(self):
-        """Calculates the offsets between a link's extremes and its parent and children joints"""
-        link_length = self.get_significant_length()
+    def calculate_offsets(self, link_length=None):
+        """Calculates the offsets between a link's extremes and its parent and children joints.
+        The current significant length of the link is used unless link_length is given"""
+        if link_length is None:
+            link_length = self.get_significant_length()
 
         link_origin_matrix = self.get_link_origin(self.link, transform=False)
         link_rotation_matrix, link_translation_vector = self.split_transformation_matrix(link_origin_matrix)
@@ -189,33 +259,196 @@ class FixedOffsetModifier():
 
         return parent_joint_offset, child_joint_offset
 
+    @staticmethod
+    def calculate_offsets_array(modifiers, link_lengths=None):
+        """Calculates the offsets of every modifier's link with the same formulas as calculate_offsets, in stacked (N,3) arrays.
+        The current significant lengths of the links are used unless link_lengths is given"""
+        link_count = len(modifiers)
+        if link_lengths is None:
+            link_lengths = [modifier.get_significant_length() for modifier in modifiers]
+        link_lengths = np.array(link_lengths, dtype=float)
+        link_origins = np.array([modifier.get_link_origin(modifier.link, transform=False) for modifier in modifiers]).reshape((-1, 4, 4))
+        unit_vectors = np.array([modifier.get_direction_vector().flatten() for modifier in modifiers]).reshape((-1, 3))
+        link_translations = link_origins[:, 0:3, 3]
+        link_directions = np.einsum('nij,nj->ni', link_origins[:, 0:3, 0:3], unit_vectors)
+        has_parent_joint = np.array([modifier.parent_joint is not None for modifier in modifiers], dtype=bool)
+        child_owners = np.array([i for i, modifier in enumerate(modifiers) for _ in modifier.child_joint_list], dtype=int)
+        child_joints = [item for modifier in modifiers for item in modifier.child_joint_list]
+        child_translations = np.array([item.origin[0:3, 3] for item in child_joints]).reshape((-1, 3))
+
+        # Using formulas: s_o = v_o - v_l * j_o / 2 and e_o = v_o + v_l * j_o / 2 - j_o
+        half_elongations = link_lengths[:, None] / 2 * link_directions
+        parent_offsets = link_translations - half_elongations
+        child_offsets = (link_translations + half_elongations)[child_owners] - child_translations
+        return OffsetArray(link_lengths, link_translations, link_directions, parent_offsets, has_parent_joint, child_offsets, child_owners, child_joints)
+
+    @staticmethod
+    def change_dimensions_and_keep_offsets(modifiers, new_lengths, offset_mask=[1,1,1], link_modifications=None, offsets=None):
+        """Changes the dimension of many links (e.g. a whole chain built with for_links or for_subtree) while keeping their offsets.
+        All offsets are computed before any change (unless already given as an OffsetArray), the inertias are updated in batch
+        and every visual and joint origin is written once. link_modifications can carry other absolute changes of every link
+        (radius, mass) performed with the same update"""
+        if offsets is None:
+            offsets = FixedOffsetModifier.calculate_offsets_array(modifiers)
+        new_lengths = np.broadcast_to(np.asarray(new_lengths, dtype=float), offsets.link_lengths.shape)
+        mask = np.array(offset_mask, dtype=bool)
+
+        if link_modifications is not None:
+            for modifier, link_modification in zip(modifiers, link_modifications):
+                modifier.link_modifier.modify_fields(link_modification)
+        for modifier, new_length in zip(modifiers, new_lengths):
+            geometry_type, _ = modifier.get_geometry(modifier.link_modifier.get_visual())
+            if geometry_type == Geometry.SPHERE:
+                modifier.link_modifier.set_radius(new_length / 2)
+            else:
+                modifier.link_modifier.set_length(new_length)
+        InertiaBatch([modifier.link_modifier for modifier in modifiers if modifier.link.inertial is not None]).update_inertias()
+
+        # Using formulas: v_o' = s_o + v_l' * j_o / 2 and j_o' = v_o' + v_l' * j_o / 2 - e_o
+        half_elongations = new_lengths[:, None] / 2 * offsets.link_directions
+        moves_link = offsets.has_parent_joint[:, None] & mask
+        new_link_translations = np.where(moves_link, offsets.parent_offsets + half_elongations, offsets.link_translations)
+        new_child_translations = (new_link_translations + half_elongations)[offsets.child_owners] - offsets.child_offsets
+
+        for i in np.flatnonzero(offsets.has_parent_joint):
+            modifiers[i].link_modifier.set_origin_position_vector(new_link_translations[i], mask)
+        joint_modifiers = {joint_modifier.element.name: joint_modifier for modifier in modifiers for joint_modifier in modifier.joint_modifier_list}
+        for item, new_child_translation in zip(offsets.child_joints, new_child_translations):
+            joint_modifiers[item.name].set_origin_position_vector(new_child_translation, mask)
+
     def modify(self, modifications):
         """Performs the modifications in the link-joint setup"""
+        self.modify_all([modifications])
+
+    def modify_all(self, modifications):
+        """Performs a list of modifications as if modify were called on each of them in order, with a single update of
+        geometry, mass and inertia and a single write of every origin (see fuse)"""
+        if self.has_mixed_offset_masks(modifications):
+            # Different masks keep different offsets, so the modifications have to be performed one at a time
+            for modification in modifications:
+                self.modify_all([modification])
+            return
+
+        fused_modification = self.fuse(modifications)
+        if fused_modification.new_length is None:
+            self.link_modifier.modify(fused_modification.link_modification)
+        else:
+            self.change_dimension_and_keep_offsets(fused_modification.new_length, fused_modification.offset_mask,
+                                                   fused_modification.link_modification, fused_modification.original_length)
 
-        trivial_modifications = Modification()
-        if modifications.radius:
-            trivial_modifications.add_radius(modifications.radius.value, modifications.radius.absolute)
-        if modifications.density:
-            trivial_modifications.add_density(modifications.density.value, modifications.density.absolute)
-        if modifications.mass:
-            trivial_modifications.add_mass(modifications.mass.value, modifications.mass.absolute)
-        
-        self.link_modifier.modify(trivial_modifications)
+    @staticmethod
+    def has_mixed_offset_masks(modifications):
+        """Returns True if the dimension modifications of the list do not all keep the same offsets, so that they cannot be fused"""
+        offset_masks = [list(modification.offset_mask) for modification in modifications if modification.dimension]
+        return any(offset_mask != offset_masks[0] for offset_mask in offset_masks)
+
+    def fuse(self, modifications):
+        """Returns the FusedOffsetModification equivalent to performing the list of modifications in order. Each modification
+        changes radius, density and mass first and then the dimension, keeping the offsets. The modifications are simulated
+        on a shadow of the link. Since every dimension change keeps the offsets, the origins only depend on the sum of the
+        length changes made by the dimension modifications, which gives the length used to compute the offsets"""
+        if self.has_mixed_offset_masks(modifications):
+            raise Exception(f"Cannot fuse dimension modifications of link {self.link.name} with different offset masks")
+        offset_masks = [list(modification.offset_mask) for modification in modifications if modification.dimension]
 
-        if modifications.dimension:
-            original_length = self.get_significant_length()
-            if modifications.dimension.absolute:
-                self.change_dimension_and_keep_offsets(modifications.dimension.value, modifications.offset_mask)
-            else:
-                self.change_dimension_and_keep_offsets(original_length * modifications.dimension.value, modifications.offset_mask)
+        geometry_type, _ = self.get_geometry(self.link_modifier.get_visual())
+        length_factor = 2 if geometry_type == Geometry.SPHERE else 1
+        shadow_modifier = self.link_modifier.get_shadow_modifier()
+        dimension_change = 0
+        for modification in modifications:
+            trivial_modifications = Modification()
+            if modification.radius:
+                trivial_modifications.add_radius(modification.radius.value, modification.radius.absolute)
+            if modification.density:
+                trivial_modifications.add_density(modification.density.value, modification.density.absolute)
+            if modification.mass:
+                trivial_modifications.add_mass(modification.mass.value, modification.mass.absolute)
+            shadow_modifier.modify_fields(trivial_modifications)
+
+            if modification.dimension:
+                original_length = shadow_modifier.get_significant_length() * length_factor
+                new_length = modification.dimension.value if modification.dimension.absolute else original_length * modification.dimension.value
+                if geometry_type == Geometry.SPHERE:
+                    shadow_modifier.set_radius(new_length / 2)
+                else:
+                    shadow_modifier.set_length(new_length)
+                dimension_change += new_length - original_length
+
+        fused_modification = FusedOffsetModification(Modification())
+        if any(modification.radius for modification in modifications):
+            fused_modification.link_modification.add_radius(shadow_modifier.get_radius(), absolute=True)
+        if any(modification.mass or modification.density for modification in modifications):
+            fused_modification.link_modification.add_mass(shadow_modifier.get_mass(), absolute=True)
+        if offset_masks:
+            fused_modification.new_length = shadow_modifier.get_significant_length() * length_factor
+            fused_modification.original_length = fused_modification.new_length - dimension_change
+            fused_modification.offset_mask = offset_masks[0]
+        return fused_modification
+
+    @staticmethod
+    def modify_many(modifiers, modifications):
+        """Performs the modifications of many links at once, modifications[i] being the list of modifications of modifiers[i].
+        The modifications of every link are fused and the offsets of all links are computed before any change. Links sharing
+        an offset mask are then changed together by change_dimensions_and_keep_offsets, so that every visual and joint origin
+        is written exactly once. A joint is only written by the modifier of its parent link and the offsets of a link do not
+        depend on its parent joint, hence the result does not depend on the order of the links.
+        The links whose dimension modifications keep different offsets cannot be fused, and are modified one modification
+        at a time after the others, as modify_all does"""
+        sequential_items = [(modifier, link_modifications) for modifier, link_modifications in zip(modifiers, modifications)
+                            if FixedOffsetModifier.has_mixed_offset_masks(link_modifications)]
+        fused_items = [(modifier, link_modifications) for modifier, link_modifications in zip(modifiers, modifications)
+                       if not FixedOffsetModifier.has_mixed_offset_masks(link_modifications)]
+        modifiers = [modifier for modifier, _ in fused_items]
+        fused_modifications = [modifier.fuse(link_modifications) for modifier, link_modifications in fused_items]
+        groups = {}
+        for modifier, fused_modification in zip(modifiers, fused_modifications):
+            if fused_modification.new_length is not None:
+                groups.setdefault(tuple(fused_modification.offset_mask), []).append((modifier, fused_modification))
+        group_offsets = {offset_mask: FixedOffsetModifier.calculate_offsets_array([modifier for modifier, _ in group],
+                                                                                  [item.original_length for _, item in group])
+                         for offset_mask, group in groups.items()}
+
+        for modifier, fused_modification in zip(modifiers, fused_modifications):
+            if fused_modification.new_length is None:
+                modifier.link_modifier.modify(fused_modification.link_modification)
+        for offset_mask, group in groups.items():
+            FixedOffsetModifier.change_dimensions_and_keep_offsets([modifier for modifier, _ in group], [item.new_length for _, item in group],
+                                                                   list(offset_mask), [item.link_modification for _, item in group],
+                                                                   offsets=group_offsets[offset_mask])
+        for modifier, link_modifications in sequential_items:
+            modifier.modify_all(link_modifications)
 
-    def change_dimension_and_keep_offsets(self, new_length, offset_mask):
-        """Changes the dimension of the link while keeping the offset between it and both parent and child joints"""
-        parent_joint_offset, child_joint_offset = self.calculate_offsets()
+    @classmethod
+    def modify_links(cls, robot, link_modifications, axis=Side.Z, robot_index=None):
+        """Performs a set of (link name, Modification) pairs with modify_many. A link can appear in several pairs,
+        its modifications are then performed in the order of the pairs"""
+        modifications = {}
+        for link_name, modification in link_modifications:
+            modifications.setdefault(link_name, []).append(modification)
+        modifiers = cls.for_links(list(modifications), robot, axis, robot_index)
+        cls.modify_many(modifiers, list(modifications.values()))
+
+    def evaluate(self, modifications):
+        """Returns the LinkEvaluation that modify would produce, with the origins of the child joints.
+        The modifications are performed on copies of the link and of its child joints, so the robot is left untouched"""
+        shadow_modifier = copy.copy(self)
+        shadow_modifier.link = clone_link(self.link)
+        shadow_modifier.link_modifier = LinkModifier(shadow_modifier.link, axis=self.link_modifier.axis)
+        shadow_modifier.child_joint_list = [clone_joint(item) for item in self.child_joint_list]
+        shadow_modifier.joint_modifier_list = [JointModifier(item, axis = Side.Z) for item in shadow_modifier.child_joint_list]
+        shadow_modifier.modify(modifications)
+        return LinkEvaluation.from_link(shadow_modifier.link, shadow_modifier.child_joint_list)
+
+    def change_dimension_and_keep_offsets(self, new_length, offset_mask, link_modification=None, original_length=None):
+        """Changes the dimension of the link while keeping the offset between it and both parent and child joints.
+        link_modification can carry other absolute changes of the link (radius, mass) performed with the same update,
+        original_length overrides the current length of the link in the computation of the offsets"""
+        parent_joint_offset, child_joint_offset = self.calculate_offsets(original_length)
         unit_vector = self.get_direction_vector()
 
         # Change dimension
-        link_modification = Modification()
+        if link_modification is None:
+            link_modification = Modification()
         geometry_type, _ = self.get_geometry(self.link_modifier.get_visual())
         if geometry_type == Geometry.SPHERE:        
             link_modification.add_radius(new_length / 2, absolute=True)
@@ -249,26 +482,34 @@ class FixedOffsetModifier():
             corresponding_modifier = [joint_modifier for joint_modifier in self.joint_modifier_list if joint_modifier.element == item.joint][0]
             self.modify_origin_three_dimensions(corresponding_modifier, new_child_origin_position, offset_mask)
 
-    def modify_origin_three_dimensions(self, modifier, new_position, offset_mask=[1,1,1]):
-        """Performs 3 position modifications to place the origin in a new X, Y and Z"""
-        original_modifier_axis = modifier.axis
-        modification = Modification()
-
-        flattened_position_array = new_position.flatten()  
+    def calculate_origin_jacobian(self, offset_mask=[1,1,1]):
+        """Calculates the closed-form derivatives, w.r.t. the significant length, of the positions written by change_dimension_and_keep_offsets.
+        Returns the gradient (3,) of the link visual origin and the list of gradients (3,) of the joints in child_joint_list
 
-        if offset_mask[0]:
-            modifier.axis = Side.X
-            modification.add_position(flattened_position_array[0], absolute=True)
-            modifier.modify(modification)
+        From v_o' = s_o + v_l' * j_o / 2 and j_o' = s_o + v_l' * j_o - e_o, the visual origin moves by half the direction of
+        elongation and the child joints by the whole direction. Without a parent joint the visual origin is not moved and
+        the child joints only move by half the direction"""
+        visual_origin_gradients, joint_origin_gradients = FixedOffsetModifier.calculate_origin_jacobians([self], offset_mask)
+        return visual_origin_gradients[0], [joint_origin_gradients[item.name] for item in self.child_joint_list]
 
-        if offset_mask[1]:
-            modifier.axis = Side.Y
-            modification.add_position(flattened_position_array[1], absolute=True)
-            modifier.modify(modification)
-
-        if offset_mask[2]:
-            modifier.axis = Side.Z
-            modification.add_position(flattened_position_array[2], absolute=True)
-            modifier.modify(modification)
+    @staticmethod
+    def calculate_origin_jacobians(modifiers, offset_mask=[1,1,1]):
+        """Vectorized calculate_origin_jacobian over many modifiers.
+        Returns the (N,3) visual origin gradients and a dictionary from child joint name to its gradient (3,)"""
+        rotation_matrices = np.array([modifier.get_link_origin(modifier.link, transform=False)[0:3, 0:3] for modifier in modifiers]).reshape((-1, 3, 3))
+        unit_vectors = np.array([modifier.get_direction_vector().flatten() for modifier in modifiers]).reshape((-1, 3))
+        directions = np.einsum('nij,nj->ni', rotation_matrices, unit_vectors) * np.array(offset_mask, dtype=bool)
+        has_parent_joint = np.array([modifier.parent_joint is not None for modifier in modifiers], dtype=bool)
+
+        visual_origin_gradients = directions / 2 * has_parent_joint[:, None]
+        joint_origin_gradients = {}
+        for i, modifier in enumerate(modifiers):
+            for item in modifier.child_joint_list:
+                joint_origin_gradients[item.name] = directions[i] if has_parent_joint[i] else directions[i] / 2
+        return visual_origin_gradients, joint_origin_gradients
 
-        modifier.axis = original_modifier_axis
+    def modify_origin_three_dimensions(self, modifier, new_position, offset_mask=[1,1,1]):
+        """Places the origin in a new X, Y and Z with a single position vector modification"""
+        modification = Modification()
+        modification.add_position_vector(new_position.flatten(), absolute=True, mask=offset_mask)
+        modifier.modify(modification)
@@ -0,0 +1,149 @@
+import numpy as np
+from urdfModifiers.core.linkModifier import LinkModifier
+from urdfModifiers.geometry import *
+
+class InertiaBatch():
+    """Class to recompute the inertia of many links at once.
+    The geometry type, dimensions and mass of every link are packed into arrays, so that box, cylinder and sphere
+    inertias are all computed with a few numpy operations instead of one LinkModifier.update_inertia call per link"""
+    def __init__(self, link_modifiers):
+        self.link_modifiers = list(link_modifiers)
+        self.inertia_tensors = None
+        self.pack()
+
+    @classmethod
+    def from_robot(cls, robot, axis = geometry.Side.Z):
+        """Creates a batch with every link of the robot having an inertial and a box, cylinder or sphere visual"""
+        link_modifiers = []
+        for link in robot.links:
+            if not link.visuals or link.inertial is None:
+                continue
+            geometry_type, _ = LinkModifier.get_geometry(LinkModifier.get_visual_static(link))
+            if geometry_type is not None:
+                link_modifiers.append(LinkModifier(link, axis))
+        return cls(link_modifiers)
+
+    def pack(self):
+        """Reads the geometry and mass of every link into the batch arrays.
+        Dimensions are stored as (x, y, z) for boxes, (radius, length, 0) for cylinders and (radius, 0, 0) for spheres,
+        length axes as the index of the modifier axis (-1 if there is none)"""
+        link_count = len(self.link_modifiers)
+        self.geometry_types = [None] * link_count
+        self.dimensions = np.zeros((link_count, 3))
+        self.masses = np.zeros(link_count)
+        self.length_axes = np.full(link_count, -1)
+        for i, link_modifier in enumerate(self.link_modifiers):
+            geometry_type, visual_data = link_modifier.get_geometry(link_modifier.get_visual())
+            self.geometry_types[i] = geometry_type
+            if geometry_type == geometry.Geometry.BOX:
+                self.dimensions[i] = visual_data.size
+            elif geometry_type == geometry.Geometry.CYLINDER:
+                self.dimensions[i, 0:2] = [visual_data.radius, visual_data.length]
+            elif geometry_type == geometry.Geometry.SPHERE:
+                self.dimensions[i, 0] = visual_data.radius
+            self.masses[i] = link_modifier.get_mass()
+            if link_modifier.axis is not None:
+                self.length_axes[i] = link_modifier.get_axis_index(link_modifier.axis)
+        self.is_box = np.array([item == geometry.Geometry.BOX for item in self.geometry_types], dtype=bool)
+        self.is_cylinder = np.array([item == geometry.Geometry.CYLINDER for item in self.geometry_types], dtype=bool)
+        self.is_sphere = np.array([item == geometry.Geometry.SPHERE for item in self.geometry_types], dtype=bool)
+
+    def calculate_volumes(self):
+        """Calculates the volume of every link with the formula that corresponds to its geometry"""
+        first, second, third = self.dimensions.T
+        return np.select([self.is_box, self.is_cylinder, self.is_sphere],
+                         [first * second * third, np.pi * first ** 2 * second, 4 * np.pi * first ** 3 / 3])
+
+    def set_densities(self, densities):
+        """Changes the mass of every link to match the given density (a scalar or one value per link)"""
+        self.masses = self.calculate_volumes() * densities
+
+    def calculate_inertias(self):
+        """Calculates the (N,3) principal inertias (ixx, iyy and izz) of every link, same formulas as LinkModifier.calculate_inertia"""
+        return self.masses[:, None] * self.calculate_unit_inertias()
+
+    def calculate_unit_inertias(self):
+        """Calculates the (N,3) principal inertias that every link would have with unit mass"""
+        squared_dimensions = self.dimensions ** 2
+        box_inertias = (squared_dimensions.sum(axis=1, keepdims=True) - squared_dimensions) / 12
+        radius_squared = squared_dimensions[:, 0]
+        cylinder_inertia_xy = (3 * radius_squared + squared_dimensions[:, 1]) / 12
+        cylinder_inertias = np.stack([cylinder_inertia_xy, cylinder_inertia_xy, radius_squared / 2], axis=1)
+        sphere_inertias = np.repeat(2 * radius_squared[:, None] / 5, 3, axis=1)
+        return np.select([self.is_box[:, None], self.is_cylinder[:, None], self.is_sphere[:, None]],
+                         [box_inertias, cylinder_inertias, sphere_inertias])
+
+    def calculate_jacobians(self):
+        """Calculates for every link the same closed-form derivatives as LinkModifier.calculate_inertia_jacobian.
+        Returns the (N,3) mass gradients and the (N,3,3) inertia jacobians, both w.r.t. (length, radius, density)"""
+        if (self.is_box & (self.length_axes < 0)).any():
+            raise Exception("Error getting length for box geometry with no axis")
+        link_count = len(self.link_modifiers)
+        volumes = self.calculate_volumes()
+        densities = self.masses / volumes
+        unit_inertias = self.calculate_unit_inertias()
+        first, second, _ = self.dimensions.T
+
+        is_length_axis = np.arange(3)[None, :] == self.length_axes[:, None]
+        box_lengths = np.where(self.is_box, self.dimensions[np.arange(link_count), self.length_axes], 0)
+        box_mass_length_derivatives = densities * np.prod(np.where(is_length_axis, 1, self.dimensions), axis=1)
+        box_length_terms = box_lengths[:, None] / 6 * ~is_length_axis
+
+        cylinder_mass_length_derivatives = densities * np.pi * first ** 2
+        cylinder_mass_radius_derivatives = densities * 2 * np.pi * first * second
+        cylinder_length_terms = np.stack([second / 6, second / 6, np.zeros(link_count)], axis=1)
+        cylinder_radius_terms = np.stack([first / 2, first / 2, first], axis=1)
+
+        sphere_mass_radius_derivatives = densities * 4 * np.pi * first ** 2
+        sphere_radius_terms = np.repeat(4 * first[:, None] / 5, 3, axis=1)
+
+        mass_length_derivatives = np.select([self.is_box, self.is_cylinder], [box_mass_length_derivatives, cylinder_mass_length_derivatives])
+        mass_radius_derivatives = np.select([self.is_cylinder, self.is_sphere], [cylinder_mass_radius_derivatives, sphere_mass_radius_derivatives])
+        length_terms = np.select([self.is_box[:, None], self.is_cylinder[:, None]], [box_length_terms, cylinder_length_terms])
+        radius_terms = np.select([self.is_cylinder[:, None], self.is_sphere[:, None]], [cylinder_radius_terms, sphere_radius_terms])
+
+        mass_gradients = np.stack([mass_length_derivatives, mass_radius_derivatives, volumes], axis=1)
+        inertia_jacobians = np.stack([mass_length_derivatives[:, None] * unit_inertias + self.masses[:, None] * length_terms,
+                                      mass_radius_derivatives[:, None] * unit_inertias + self.masses[:, None] * radius_terms,
+                                      volumes[:, None] * unit_inertias], axis=2)
+        return mass_gradients, inertia_jacobians
+
+    def calculate_inertia_tensors(self):
+        """Calculates the stacked (N,3,3) diagonal inertia tensors, with the same lower bound used by LinkModifier.update_inertia"""
+        principal_inertias = np.maximum(self.calculate_inertias(), 0.01)
+        self.inertia_tensors = np.zeros((len(self.link_modifiers), 3, 3))
+        diagonal = np.arange(3)
+        self.inertia_tensors[:, diagonal, diagonal] = principal_inertias
+        return self.inertia_tensors
+
+    def get_inertia_tensors(self):
+        """Returns the stacked (N,3,3) inertia tensors currently stored in the links"""
+        return np.array([link_modifier.element.inertial.inertia for link_modifier in self.link_modifiers])
+
+    def rescale_inertias(self, new_masses):
+        """Changes the mass of every link (a scalar or one value per link) and scales its current inertia tensor
+        by new_mass/old_mass, which keeps off-diagonal terms e.g. coming from CAD. Links with zero mass, or with a diagonal
+        term clamped to the lower bound of calculate_inertia_tensors, are recomputed instead"""
+        new_masses = np.broadcast_to(np.asarray(new_masses, dtype=float), self.masses.shape)
+        current_tensors = self.get_inertia_tensors().reshape((-1, 3, 3))
+        is_scalable = (self.masses != 0) & ~np.any(np.diagonal(current_tensors, axis1=1, axis2=2) <= 0.01, axis=1)
+        factors = np.divide(new_masses, self.masses, out=np.ones_like(self.masses), where=is_scalable)
+        self.masses = new_masses.copy()
+        if is_scalable.all():
+            self.inertia_tensors = current_tensors * factors[:, None, None]
+        else:
+            self.inertia_tensors = np.where(is_scalable[:, None, None], current_tensors * factors[:, None, None], self.calculate_inertia_tensors())
+        return self.inertia_tensors
+
+    def write_back(self):
+        """Writes the masses and the last computed inertia tensors back to the links"""
+        for i, link_modifier in enumerate(self.link_modifiers):
+            link_modifier.set_mass(self.masses[i])
+            if self.inertia_tensors is not None:
+                link_modifier.notify_change(geometry.ElementField.INERTIA)
+                link_modifier.element.inertial.inertia[:, :] = self.inertia_tensors[i]
+
+    def update_inertias(self):
+        """Recomputes the inertia of every link in the batch and writes the results back"""
+        self.calculate_inertia_tensors()
+        self.write_back()
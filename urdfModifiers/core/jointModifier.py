@@ -1,6 +1,8 @@
 from urdfModifiers.core import modifier
+from urdfModifiers.core.evaluation import clone_joint
+from urdfModifiers.core.modification import Modification
 from urdfModifiers.geometry.geometry import *
-from urchin import xyz_rpy_to_matrix, matrix_to_xyz_rpy 
+import numpy as np
 
 class JointModifier(modifier.Modifier):
     """Class to modify joints in a URDF"""
@@ -10,14 +12,17 @@ class JointModifier(modifier.Modifier):
         
 
     @classmethod
-    def from_name(cls, joint_name, robot, axis = None):
+    def from_name(cls, joint_name, robot, axis = None, robot_index = None):
         """Creates an instance of LinkModifier by passing the robot object and link name"""
-        joint = JointModifier.get_element_by_name(joint_name, robot)
+        joint = JointModifier.get_element_by_name(joint_name, robot, robot_index)
         return cls(joint, axis)
 
     @staticmethod
-    def get_element_by_name(joint_name, robot):
-        """Explores the robot looking for the joint whose name matches the first argument"""
+    def get_element_by_name(joint_name, robot, robot_index = None):
+        """Explores the robot looking for the joint whose name matches the first argument.
+        If a RobotIndex is given the lookup is performed on it instead of scanning the robot"""
+        if robot_index is not None:
+            return robot_index.get_joint(joint_name)
         joint_list = [corresponding_joint for corresponding_joint in robot.joints if corresponding_joint.name == joint_name]
         if len(joint_list) != 0:
             return joint_list[0]
@@ -27,28 +32,67 @@ class JointModifier(modifier.Modifier):
     def modify(self, modifications):
         """Performs the position modifications to the current joint"""
         if modifications.position:
-            if self.axis is None:
-                raise Exception('Axis not specified for joint')
-            xyz_rpy = matrix_to_xyz_rpy(self.element.origin)
-            original_x = xyz_rpy[0]
-            original_y = xyz_rpy[1]
-            original_z = xyz_rpy[2]
             if modifications.position.absolute:
-                if (self.axis == Side.X):
-                    xyz_rpy[0] = modifications.position.value
-                elif (self.axis == Side.Y):
-                    xyz_rpy[1] = modifications.position.value
-                elif (self.axis == Side.Z):
-                    xyz_rpy[2] = modifications.position.value
+                self.set_origin_position(modifications.position.value)
             else:
-                if (self.axis == Side.X):
-                    xyz_rpy[0] = original_x * modifications.position.value
-                elif (self.axis == Side.Y):
-                    xyz_rpy[1] = original_y * modifications.position.value
-                elif (self.axis == Side.Z):
-                    xyz_rpy[2] = original_z * modifications.position.value
-            self.element.origin = xyz_rpy_to_matrix(xyz_rpy) 
-            
+                self.set_origin_position(self.get_origin_position() * modifications.position.value)
+
+        if modifications.position_vector:
+            if modifications.position_vector.absolute:
+                self.set_origin_position_vector(modifications.position_vector.value, modifications.position_mask)
+            else:
+                original_position_vector = self.get_origin_position_vector()
+                self.set_origin_position_vector(original_position_vector * modifications.position_vector.value, modifications.position_mask)
+
         if modifications.joint_type: 
+            self.notify_change(ElementField.JOINT_TYPE)
             self.element.joint_type = modifications.joint_type
-                
+
+    def fuse(self, modifications):
+        """Returns a single Modification, with absolute values, equivalent to performing the list of modifications in order.
+        The modifications are simulated on a copy of the joint, so the origin only has to be written once"""
+        shadow_modifier = JointModifier(clone_joint(self.element), self.axis)
+        position_mask = np.zeros(3, dtype=bool)
+        fused_modification = Modification()
+        for modification in modifications:
+            shadow_modifier.modify(modification)
+            if modification.position:
+                position_mask[self.get_axis_index(self.axis)] = True
+            if modification.position_vector:
+                position_mask |= np.array(modification.position_mask, dtype=bool)
+            if modification.joint_type:
+                fused_modification.add_joint_type(modification.joint_type)
+        if position_mask.any():
+            fused_modification.add_position_vector(shadow_modifier.get_origin_position_vector(), absolute=True, mask=position_mask.tolist())
+        return fused_modification
+
+    def modify_all(self, modifications):
+        """Performs a list of modifications as if modify were called on each of them in order, writing the origin only once"""
+        self.modify(self.fuse(modifications))
+
+    def get_origin_position(self):
+        """Returns the coordinate of the joint origin along the modifier axis"""
+        if self.axis is None:
+            raise Exception('Axis not specified for joint')
+        return self.element.origin[self.get_axis_index(self.axis), 3]
+
+    def set_origin_position(self, value):
+        """Sets the coordinate of the joint origin along the modifier axis, leaving the rotation untouched"""
+        if self.axis is None:
+            raise Exception('Axis not specified for joint')
+        origin = self.element.origin.copy()
+        origin[self.get_axis_index(self.axis), 3] = value
+        self.notify_change(ElementField.JOINT_ORIGIN)
+        self.element.origin = origin
+
+    def get_origin_position_vector(self):
+        """Returns the three coordinates of the joint origin"""
+        return self.element.origin[0:3, 3].copy()
+
+    def set_origin_position_vector(self, position, mask=[1,1,1]):
+        """Sets the coordinates of the joint origin selected by the mask with a single write"""
+        origin = self.element.origin.copy()
+        mask = np.array(mask, dtype=bool)
+        origin[0:3, 3][mask] = np.asarray(position, dtype=float)[mask]
+        self.notify_change(ElementField.JOINT_ORIGIN)
+        self.element.origin = origin
@@ -1,8 +1,10 @@
 from dataclasses import dataclass
-from urchin import xyz_rpy_to_matrix, matrix_to_xyz_rpy
 from urdfModifiers.core import modifier
+from urdfModifiers.core.evaluation import LinkEvaluation, clone_geometry, clone_inertial, clone_link
+from urdfModifiers.core.modification import Modification
 import math
 import numpy as np
+from urchin import Link, Visual
 from urdfModifiers.geometry import * 
 
 @dataclass
@@ -14,13 +16,16 @@ class LinkModifier(modifier.Modifier):
         self.axis = axis
 
     @classmethod
-    def from_name(cls, link_name, robot, axis = None):
+    def from_name(cls, link_name, robot, axis = None, robot_index = None):
         """Creates an instance of LinkModifier by passing the robot object and link name"""
-        return cls(LinkModifier.get_element_by_name(link_name, robot), axis)
+        return cls(LinkModifier.get_element_by_name(link_name, robot, robot_index), axis)
 
     @staticmethod
-    def get_element_by_name(link_name, robot):
-        """Explores the robot looking for the link whose name matches the first argument"""
+    def get_element_by_name(link_name, robot, robot_index = None):
+        """Explores the robot looking for the link whose name matches the first argument.
+        If a RobotIndex is given the lookup is performed on it instead of scanning the robot"""
+        if robot_index is not None:
+            return robot_index.get_link(link_name)
         link_list = [corresponding_link for corresponding_link in robot.links if corresponding_link.name == link_name]
         if len(link_list) != 0:
             return link_list[0]
@@ -28,11 +33,27 @@ class LinkModifier(modifier.Modifier):
             return None
 
     def modify(self, modifications):
-        """Performs the dimension and density modifications to the current link"""
-        original_density = self.calculate_density()
-        original_radius = self.get_radius()
-        original_length = self.get_significant_length()
-        original_mass = self.get_mass()
+        """Performs the dimension and density modifications to the current link.
+        Original quantities are only evaluated when a relative modification needs them. The inertia is recomputed
+        when the geometry changed, and linearly rescaled when only the mass changed, unless its diagonal was clamped
+        to the lower bound of update_inertia"""
+        if modifications.mass or modifications.density:
+            original_mass = self.get_mass()
+        self.modify_fields(modifications)
+        if modifications.radius or modifications.dimension:
+            self.update_inertia()
+        elif modifications.density or modifications.mass:
+            if original_mass and not self.has_clamped_inertia():
+                self.scale_inertia(self.get_mass() / original_mass)
+            else:
+                self.update_inertia()
+
+    def modify_fields(self, modifications):
+        """Performs the geometry, mass and origin modifications to the current link, without updating the inertia"""
+        if modifications.density and not modifications.density.absolute:
+            original_density = self.calculate_density()
+        if modifications.mass and not modifications.mass.absolute:
+            original_mass = self.get_mass()
         if modifications.radius:
             geometry_type, _ = self.get_geometry(self.get_visual())
             if geometry_type == geometry.Geometry.BOX:
@@ -40,6 +61,7 @@ class LinkModifier(modifier.Modifier):
             if modifications.radius.absolute:
                 self.set_radius(modifications.radius.value)
             else:
+                original_radius = self.get_radius()
                 if original_radius is not None:
                     self.set_radius(original_radius * modifications.radius.value)
         if modifications.dimension:
@@ -49,6 +71,7 @@ class LinkModifier(modifier.Modifier):
             if modifications.dimension.absolute:
                 self.set_length(modifications.dimension.value)
             else:
+                original_length = self.get_significant_length()
                 if original_length is not None:
                     self.set_length(original_length * modifications.dimension.value)
         if modifications.density:
@@ -67,7 +90,57 @@ class LinkModifier(modifier.Modifier):
                 self.set_origin_position(modifications.position.value)
             else:
                 self.set_origin_position(original_position * modifications.position.value)
-        self.update_inertia()
+        if modifications.position_vector:
+            if modifications.position_vector.absolute:
+                self.set_origin_position_vector(modifications.position_vector.value, modifications.position_mask)
+            else:
+                original_position_vector = self.get_origin_position_vector()
+                self.set_origin_position_vector(original_position_vector * modifications.position_vector.value, modifications.position_mask)
+
+    def get_shadow_modifier(self):
+        """Returns a modifier of a lightweight copy of the link holding only its visual geometry, visual origin and inertial.
+        It is used to simulate modifications without touching the link"""
+        visual = self.get_visual()
+        inertial = clone_inertial(self.element.inertial) if self.element.inertial is not None else None
+        shadow_link = Link(self.element.name, inertial, [Visual(clone_geometry(visual.geometry), origin=visual.origin)], [])
+        return LinkModifier(shadow_link, self.axis)
+
+    def fuse(self, modifications):
+        """Returns a single Modification, with absolute values, equivalent to performing the list of modifications in order.
+        The modifications are simulated on a shadow of the link, so each field only has to be written once.
+        Later absolute values override earlier ones and later relative values scale the result of the earlier ones"""
+        shadow_modifier = self.get_shadow_modifier()
+        position_mask = np.zeros(3, dtype=bool)
+        fused_modification = Modification()
+        for modification in modifications:
+            shadow_modifier.modify_fields(modification)
+            if modification.position:
+                position_mask[self.get_axis_index(self.axis)] = True
+            if modification.position_vector:
+                position_mask |= np.array(modification.position_mask, dtype=bool)
+            if modification.dimension:
+                fused_modification.add_offset_mask(modification.offset_mask)
+        if any(modification.radius for modification in modifications):
+            fused_modification.add_radius(shadow_modifier.get_radius(), absolute=True)
+        if any(modification.dimension for modification in modifications):
+            fused_modification.add_dimension(shadow_modifier.get_significant_length(), absolute=True)
+        if any(modification.mass or modification.density for modification in modifications):
+            fused_modification.add_mass(shadow_modifier.get_mass(), absolute=True)
+        if position_mask.any():
+            fused_modification.add_position_vector(shadow_modifier.get_origin_position_vector(), absolute=True, mask=position_mask.tolist())
+        return fused_modification
+
+    def modify_all(self, modifications):
+        """Performs a list of modifications as if modify were called on each of them in order,
+        writing every field and updating the inertia only once"""
+        self.modify(self.fuse(modifications))
+
+    def evaluate(self, modifications):
+        """Returns the LinkEvaluation (mass, inertia and visual origin) that modify would produce.
+        The modifications are performed on a copy of the link, so the robot is left untouched"""
+        shadow_modifier = LinkModifier(clone_link(self.element), self.axis)
+        shadow_modifier.modify(modifications)
+        return LinkEvaluation.from_link(shadow_modifier.element)
 
     def get_visual(self):
         """Returns the visual object of a link"""
@@ -106,14 +179,18 @@ class LinkModifier(modifier.Modifier):
         """Sets the radius of a link if its geometry is cylider or sphere"""
         geometry_type, visual_data = self.get_geometry(self.get_visual())
         if (geometry_type == geometry.Geometry.CYLINDER or geometry_type == geometry.Geometry.SPHERE):
+            self.notify_change(geometry.ElementField.VISUAL_GEOMETRY)
             visual_data.radius = new_radius
         geometry_type_collision, visual_data_collision = self.get_geometry(self.get_collision())
         if geometry_type_collision and (geometry_type_collision == geometry.Geometry.CYLINDER or geometry_type_collision == geometry.Geometry.SPHERE):
+            self.notify_change(geometry.ElementField.COLLISION_GEOMETRY)
             visual_data_collision.radius = new_radius
 
     def set_length(self, length):
         """Modifies a link's length, in a manner that is logical with its geometry"""
         geometry_type, visual_data = self.get_geometry(self.get_visual())
+        if (geometry_type == geometry.Geometry.BOX or geometry_type == geometry.Geometry.CYLINDER):
+            self.notify_change(geometry.ElementField.VISUAL_GEOMETRY)
         if (geometry_type == geometry.Geometry.BOX):
             if (self.axis is not None):
                 if (self.axis == geometry.Side.X):
@@ -127,6 +204,8 @@ class LinkModifier(modifier.Modifier):
         elif (geometry_type == geometry.Geometry.CYLINDER):
             visual_data.length = length
         geometry_type_collision, visual_data_collision = self.get_geometry(self.get_collision())
+        if (geometry_type_collision == geometry.Geometry.BOX or geometry_type_collision == geometry.Geometry.CYLINDER):
+            self.notify_change(geometry.ElementField.COLLISION_GEOMETRY)
         if (geometry_type_collision == geometry.Geometry.BOX):
             if (self.axis is not None):
                 if (self.axis == geometry.Side.X):
@@ -141,38 +220,48 @@ class LinkModifier(modifier.Modifier):
             visual_data_collision.length = length
 
     def get_origin_position(self):
+        """Returns the coordinate of the visual origin along the modifier axis"""
         visual_object = self.get_visual()
         if (self.axis is not None):
-            if (self.axis == geometry.Side.X):
-                return matrix_to_xyz_rpy(visual_object.origin)[0]
-            elif (self.axis == geometry.Side.Y):
-                return matrix_to_xyz_rpy(visual_object.origin)[1]
-            elif (self.axis == geometry.Side.Z):
-                return matrix_to_xyz_rpy(visual_object.origin)[2]
+            return visual_object.origin[self.get_axis_index(self.axis), 3]
         else:
             raise Exception(f"Error modifying link {self.element.name}'s position: no axis")
 
     def set_origin_position(self, value):
+        """Sets the coordinate along the modifier axis of the visual, collision and inertial origins.
+        Only the translation column is written, so the rotation is left untouched"""
+        if (self.axis is not None):
+            origin = self.get_visual().origin.copy()
+            origin[self.get_axis_index(self.axis), 3] = value
+            self.set_origin(origin)
+        else:
+            raise Exception(f"Error modifying link {self.element.name}'s position: no axis")
+
+    def get_origin_position_vector(self):
+        """Returns the three coordinates of the visual origin"""
+        return self.get_visual().origin[0:3, 3].copy()
+
+    def set_origin_position_vector(self, position, mask=[1,1,1]):
+        """Sets the coordinates selected by the mask of the visual, collision and inertial origins with a single write"""
+        origin = self.get_visual().origin.copy()
+        mask = np.array(mask, dtype=bool)
+        origin[0:3, 3][mask] = np.asarray(position, dtype=float)[mask]
+        self.set_origin(origin)
+
+    def set_origin(self, origin):
+        """Sets the visual origin matrix and shares it (as copies) with the collision and inertial origins"""
         visual_object = self.get_visual()
         collision_object = self.get_collision()
         inertia = self.element.inertial
 
-        origin = matrix_to_xyz_rpy(visual_object.origin)
-
-        if (self.axis is not None):
-            if (self.axis == geometry.Side.X):
-                origin[0] = value
-            elif (self.axis == geometry.Side.Y):
-                origin[1] = value
-            elif (self.axis == geometry.Side.Z):
-                origin[2] = value
-            visual_object.origin = xyz_rpy_to_matrix(origin)
-            if (collision_object is not None):
-                collision_object.origin = xyz_rpy_to_matrix(origin)
-            if (inertia is not None):
-                inertia.origin = xyz_rpy_to_matrix(origin)
-        else:
-            raise Exception(f"Error modifying link {self.element.name}'s position: no axis")
+        self.notify_change(geometry.ElementField.VISUAL_ORIGIN)
+        visual_object.origin = origin
+        if (collision_object is not None):
+            self.notify_change(geometry.ElementField.COLLISION_ORIGIN)
+            collision_object.origin = origin.copy()
+        if (inertia is not None):
+            self.notify_change(geometry.ElementField.INERTIAL_ORIGIN)
+            inertia.origin = origin.copy()
 
     @staticmethod
     def get_visual_static(link):
@@ -190,6 +279,7 @@ class LinkModifier(modifier.Modifier):
             return [geometry.Geometry.CYLINDER, geometry_holder.geometry.cylinder]
         if (geometry_holder.geometry.sphere is not None):
             return [geometry.Geometry.SPHERE, geometry_holder.geometry.sphere]
+        return [None, None]
         
 
     def calculate_volume(self, geometry_type, visual_data):
@@ -207,6 +297,7 @@ class LinkModifier(modifier.Modifier):
 
     def set_mass(self, new_mass):
         """Sets the mass value to a new value"""
+        self.notify_change(geometry.ElementField.MASS)
         self.element.inertial.mass = new_mass
 
     def calculate_density(self):
@@ -218,6 +309,7 @@ class LinkModifier(modifier.Modifier):
         """Changes the mass of a link by preserving a given density."""
         geometry_type, visual_data = self.get_geometry(self.get_visual())
         volume = self.calculate_volume(geometry_type, visual_data)
+        self.notify_change(geometry.ElementField.MASS)
         self.element.inertial.mass = volume * density
 
     def calculate_inertia(self):
@@ -236,18 +328,67 @@ class LinkModifier(modifier.Modifier):
             inertia = 2 * mass * visual_data.radius ** 2 / 5
             return np.array([inertia, inertia, inertia])
 
+    def calculate_inertia_jacobian(self):
+        """Calculates the closed-form derivatives of the mass and of the inertia (ixx, iyy and izz) with respect to
+        the length, the radius and the density of the link, with the density held constant for the geometric ones.
+        Returns the mass gradient (3,) and the inertia jacobian (3,3), whose columns follow the (length, radius, density) order.
+        Derivatives are those of the formulas in calculate_inertia, i.e. without the lower bound applied by update_inertia"""
+        geometry_type, visual_data = self.get_geometry(self.get_visual())
+        mass = self.get_mass()
+        volume = self.calculate_volume(geometry_type, visual_data)
+        density = mass / volume
+        if (geometry_type == geometry.Geometry.BOX):
+            if (self.axis is None):
+                raise Exception(f"Error getting length for link {self.element.name}'s volume: Box geometry with no axis")
+            axis_index = self.get_axis_index(self.axis)
+            size = np.array(visual_data.size, dtype=float)
+            unit_inertia = (np.sum(size ** 2) - size ** 2) / 12
+            mass_length_derivative = density * np.prod(np.delete(size, axis_index))
+            inertia_length_derivative = mass_length_derivative * unit_inertia + mass * size[axis_index] / 6 * (np.arange(3) != axis_index)
+            mass_gradient = np.array([mass_length_derivative, 0, volume])
+            inertia_jacobian = np.column_stack([inertia_length_derivative, np.zeros(3), volume * unit_inertia])
+        elif (geometry_type == geometry.Geometry.CYLINDER):
+            radius = visual_data.radius
+            length = visual_data.length
+            unit_inertia = np.array([(3 * radius ** 2 + length ** 2) / 12, (3 * radius ** 2 + length ** 2) / 12, radius ** 2 / 2])
+            mass_length_derivative = density * math.pi * radius ** 2
+            mass_radius_derivative = density * 2 * math.pi * radius * length
+            mass_gradient = np.array([mass_length_derivative, mass_radius_derivative, volume])
+            inertia_jacobian = np.column_stack([mass_length_derivative * unit_inertia + mass * np.array([length / 6, length / 6, 0]),
+                                                mass_radius_derivative * unit_inertia + mass * np.array([radius / 2, radius / 2, radius]),
+                                                volume * unit_inertia])
+        elif (geometry_type == geometry.Geometry.SPHERE):
+            radius = visual_data.radius
+            unit_inertia = np.full(3, 2 * radius ** 2 / 5)
+            mass_radius_derivative = density * 4 * math.pi * radius ** 2
+            mass_gradient = np.array([0, mass_radius_derivative, volume])
+            inertia_jacobian = np.column_stack([np.zeros(3),
+                                                mass_radius_derivative * unit_inertia + mass * np.full(3, 4 * radius / 5),
+                                                volume * unit_inertia])
+        return mass_gradient, inertia_jacobian
+
     def update_inertia(self):
         """Updates the inertia of a link to match its volume and mass."""
         if (self.element.inertial is not None):
             inertia = self.element.inertial.inertia
             new_inertia = self.calculate_inertia()
             new_inertia[new_inertia < 0.01] = 0.01
-            for i in range(3):
-                for j in range(3):
-                    if (i == j):
-                        inertia[i,j] = new_inertia[i]
-                    else:
-                        inertia[i,j] = 0
+            self.notify_change(geometry.ElementField.INERTIA)
+            inertia[:, :] = np.diag(new_inertia)
+
+    def has_clamped_inertia(self):
+        """Returns True if a diagonal term of the inertia is at the lower bound of update_inertia and the geometry allows
+        recomputing it. A clamped inertia does not scale with the mass, so it has to be recomputed"""
+        if self.element.inertial is None or not np.any(np.diag(self.element.inertial.inertia) <= 0.01):
+            return False
+        geometry_type, _ = self.get_geometry(self.get_visual())
+        return geometry_type is not None
+
+    def scale_inertia(self, factor):
+        """Scales the whole inertia tensor, off-diagonal terms included, e.g. by new_mass/old_mass when the geometry is unchanged"""
+        if (self.element.inertial is not None):
+            self.notify_change(geometry.ElementField.INERTIA)
+            self.element.inertial.inertia[:, :] *= factor
 
     def __str__(self):
         return f"Link modifier with name {self.element.name}, origin modifier {self.origin_modifier}, axis {self.axis}"
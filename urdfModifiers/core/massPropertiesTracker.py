@@ -0,0 +1,125 @@
+import numpy as np
+from urdfModifiers.core.modifier import attach_observer, detach_observer, get_robot_attachment, remove_robot_attachment, set_robot_attachment
+from urdfModifiers.core.robotIndex import RobotIndex
+from urdfModifiers.geometry.geometry import ElementField
+
+class SubtreeMassProperties():
+    """Class holding the aggregated mass properties of a subtree, expressed in the frame of its root link:
+    total mass, first moment of mass (mass times center of mass) and inertia about the link frame origin"""
+    def __init__(self, mass=0.0, first_moment=None, origin_inertia=None):
+        self.mass = mass
+        self.first_moment = np.zeros(3) if first_moment is None else first_moment
+        self.origin_inertia = np.zeros((3, 3)) if origin_inertia is None else origin_inertia
+
+    @staticmethod
+    def point_mass_inertia(mass, position):
+        """Returns the inertia of a point mass about the origin: m * (|p|^2 E - p p^T)"""
+        return mass * (np.dot(position, position) * np.eye(3) - np.outer(position, position))
+
+    def get_center_of_mass(self):
+        """Returns the center of mass of the subtree, or the frame origin if the subtree has no mass"""
+        return self.first_moment / self.mass if self.mass else np.zeros(3)
+
+    def get_inertia(self):
+        """Returns the composite inertia of the subtree about its center of mass"""
+        return self.origin_inertia - self.point_mass_inertia(self.mass, self.get_center_of_mass())
+
+    def add(self, other, transform=None):
+        """Adds the properties of another subtree, whose frame has the given 4x4 pose in this frame"""
+        if transform is None:
+            transform = np.eye(4)
+        rotation_matrix = transform[0:3, 0:3]
+        center_of_mass = np.dot(rotation_matrix, other.get_center_of_mass()) + transform[0:3, 3]
+        self.mass += other.mass
+        self.first_moment = self.first_moment + other.mass * center_of_mass
+        self.origin_inertia = (self.origin_inertia + np.dot(rotation_matrix, np.dot(other.get_inertia(), rotation_matrix.T)) +
+                               self.point_mass_inertia(other.mass, center_of_mass))
+
+class MassPropertiesTracker():
+    """Class keeping the mass, center of mass and composite inertia of every subtree of a robot up to date.
+    It observes the links and joints of the robot: a change of a link mass, inertia or inertial origin, or of a joint origin,
+    marks the affected link and its ancestors as dirty in O(depth). Dirty subtrees are recomputed lazily from the cached
+    properties of their clean children"""
+    def __init__(self, robot, robot_index=None):
+        self.robot = robot
+        self.robot_index = robot_index if robot_index is not None else RobotIndex(robot)
+        self.subtree_properties = {}
+        self.dirty_links = set(link.name for link in self.robot.links)
+        self.root_link_name = next(link.name for link in self.robot.links if self.robot_index.get_parent_joint(link.name) is None)
+        for element in self.robot.links + self.robot.joints:
+            attach_observer(element, self)
+
+    @classmethod
+    def of(cls, robot, robot_index=None):
+        """Returns the mass properties tracker attached to the robot, creating it on first use"""
+        instance = get_robot_attachment(robot, cls)
+        if instance is None:
+            instance = cls(robot, robot_index)
+            set_robot_attachment(robot, cls, instance)
+        return instance
+
+    def detach(self):
+        """Stops observing the robot elements and removes the tracker from the robot"""
+        for element in self.robot.links + self.robot.joints:
+            detach_observer(element, self)
+        remove_robot_attachment(self.robot, type(self), self)
+
+    def on_element_change(self, element, field):
+        if field == ElementField.JOINT_ORIGIN:
+            self.mark_dirty(element.parent)
+        elif field in (ElementField.MASS, ElementField.INERTIA, ElementField.INERTIAL_ORIGIN):
+            self.mark_dirty(element.name)
+
+    def invalidate(self):
+        """Marks every subtree as dirty, e.g. after structural changes of the robot"""
+        self.robot_index.invalidate()
+        self.dirty_links = set(link.name for link in self.robot.links)
+
+    def mark_dirty(self, link_name):
+        """Marks the link and its ancestors as dirty. Ancestors of dirty links are dirty already, so the walk stops at the first one"""
+        while link_name is not None and link_name not in self.dirty_links:
+            self.dirty_links.add(link_name)
+            parent_joint = self.robot_index.get_parent_joint(link_name)
+            link_name = parent_joint.parent if parent_joint is not None else None
+
+    def get_link_properties(self, link_name):
+        """Returns the mass properties of the link alone, in its frame"""
+        inertial = self.robot_index.get_link(link_name).inertial
+        if inertial is None:
+            return SubtreeMassProperties()
+        rotation_matrix = inertial.origin[0:3, 0:3]
+        center_of_mass = inertial.origin[0:3, 3]
+        return SubtreeMassProperties(inertial.mass, inertial.mass * center_of_mass,
+                                     np.dot(rotation_matrix, np.dot(inertial.inertia, rotation_matrix.T)) +
+                                     SubtreeMassProperties.point_mass_inertia(inertial.mass, center_of_mass))
+
+    def get_subtree_properties(self, link_name):
+        """Returns the SubtreeMassProperties of the subtree starting at the link, recomputing only its dirty part"""
+        links_to_visit = [(link_name, False)]
+        while links_to_visit:
+            current_link_name, children_done = links_to_visit.pop()
+            if current_link_name not in self.dirty_links:
+                continue
+            child_joints = self.robot_index.get_child_joints(current_link_name)
+            if not children_done:
+                links_to_visit.append((current_link_name, True))
+                links_to_visit += [(joint.child, False) for joint in child_joints]
+                continue
+            properties = self.get_link_properties(current_link_name)
+            for joint in child_joints:
+                properties.add(self.subtree_properties[joint.child], joint.origin)
+            self.subtree_properties[current_link_name] = properties
+            self.dirty_links.discard(current_link_name)
+        return self.subtree_properties[link_name]
+
+    def get_total_mass(self):
+        """Returns the mass of the whole robot"""
+        return self.get_subtree_properties(self.root_link_name).mass
+
+    def get_center_of_mass(self):
+        """Returns the center of mass of the whole robot in the root link frame"""
+        return self.get_subtree_properties(self.root_link_name).get_center_of_mass()
+
+    def get_composite_inertia(self, link_name=None):
+        """Returns the composite inertia about its center of mass of the subtree starting at the link (the whole robot by default)"""
+        return self.get_subtree_properties(link_name if link_name is not None else self.root_link_name).get_inertia()
@@ -1,4 +1,10 @@
 from dataclasses import dataclass
+import itertools
+import re
+import numpy as np
+
+_LINSPACE_PATTERN = re.compile(r'^\s*linspace\s*\((.*)\)\s*$')
+_LIST_PATTERN = re.compile(r'^\s*\[(.*)\]\s*$')
 
 @dataclass
 class ModificationType:
@@ -13,55 +19,65 @@ class ModificationType:
 @dataclass
 class Modification:
     """Class to describe the modifications to perform to a link"""    
+    # Numeric configuration keys, in reading order, with the method adding them and whether they are absolute
+    config_keys = [('dimension_scale', 'add_dimension', False), ('dimension', 'add_dimension', True),
+                   ('density_scale', 'add_density', False), ('density', 'add_density', True),
+                   ('mass_scale', 'add_mass', False), ('mass', 'add_mass', True),
+                   ('radius_scale', 'add_radius', False), ('radius', 'add_radius', True),
+                   ('position_scale', 'add_position', False), ('position', 'add_position', True)]
+
     def __init__(self):
         self.mass = None
         self.density = None
         self.dimension = None
         self.radius = None
         self.position = None
+        self.position_vector = None
+        self.position_mask = [1,1,1]
         self.joint_type = None 
         self.offset_mask = [1,1,1]
         pass
 
+    @staticmethod
+    def parse_config_values(text):
+        """Returns the list of values of a configuration entry: a single number, a list such as [500, 1000, 2000]
+        or a range such as linspace(0.8, 1.2, 21)"""
+        linspace_match = _LINSPACE_PATTERN.match(text)
+        if linspace_match:
+            arguments = linspace_match.group(1).split(',')
+            if len(arguments) != 3:
+                raise Exception(f"Invalid range {text}, expected linspace(start, stop, count)")
+            return [float(value) for value in np.linspace(float(arguments[0]), float(arguments[1]), int(arguments[2]))]
+        list_match = _LIST_PATTERN.match(text)
+        if list_match:
+            return [float(value) for value in list_match.group(1).split(',') if value.strip()]
+        return [float(text)]
+
     @classmethod
-    def from_config_section(cls, config_section):
-        """Constructs a modification from a section of a configparser.ConfigParser class"""
-        new_modification = cls()
+    def get_config_entries(cls, config_section):
+        """Returns the (key, values) pairs of the numeric entries found in a section of a configparser.ConfigParser class"""
+        return [(key, cls.parse_config_values(config_section[key])) for key, _, _ in cls.config_keys
+                if config_section.get(key, None) is not None]
+
+    @staticmethod
+    def combine_values(value_lists, zipped=False):
+        """Returns a lazy iterator over the combinations of the value lists, either their cartesian product or,
+        if zipped is True, their element-wise combination (single values are repeated)"""
+        if not zipped:
+            return itertools.product(*value_lists)
+        lengths = set(len(values) for values in value_lists if len(values) > 1)
+        if len(lengths) > 1:
+            raise Exception("Invalid sweep, zipped entries must have the same number of values")
+        count = lengths.pop() if lengths else 1
+        return zip(*[values * count if len(values) == 1 else values for values in value_lists])
 
-        dimension_scale = config_section.get('dimension_scale', None)
-        if dimension_scale is not None:
-            new_modification.add_dimension(float(dimension_scale), False)
-        dimension = config_section.get('dimension', None)
-        if dimension is not None:
-            new_modification.add_dimension(float(dimension), True)
-        
-        density_scale = config_section.get('density_scale', None)
-        if density_scale is not None:
-            new_modification.add_density(float(density_scale), False)
-        density = config_section.get('density', None)
-        if density is not None:
-            new_modification.add_density(float(density), True)
-        
-        mass_scale = config_section.get('mass_scale', None)
-        if mass_scale is not None:
-            new_modification.add_mass(float(mass_scale), False)
-        mass = config_section.get('mass', None)
-        if mass is not None:
-            new_modification.add_mass(float(mass), True)
-
-        radius_scale = config_section.get('radius_scale', None)
-        if radius_scale is not None:
-            new_modification.add_radius(float(radius_scale), False)
-        radius = config_section.get('radius', None)
-        if radius is not None:
-            new_modification.add_radius(float(radius), True)
-
-        position_scale = config_section.get('position_scale', None)
-        if position_scale is not None:
-            new_modification.add_position(float(position_scale), False)
-        position = config_section.get('position', None)
-        if position is not None:
-            new_modification.add_position(float(position), True)
+    @classmethod
+    def from_config_values(cls, config_section, values):
+        """Constructs a modification from a dictionary of numeric values, indexed by configuration key, and the joint type of the section"""
+        new_modification = cls()
+        for key, add_method, absolute in cls.config_keys:
+            if key in values:
+                getattr(new_modification, add_method)(values[key], absolute)
 
         joint_type_modification = config_section.get('joint_type', None)
 
@@ -70,6 +86,25 @@ class Modification:
 
         return new_modification
 
+    @classmethod
+    def from_config_section(cls, config_section):
+        """Constructs a modification from a section of a configparser.ConfigParser class"""
+        values = {}
+        for key, key_values in cls.get_config_entries(config_section):
+            if len(key_values) != 1:
+                raise Exception(f"Entry {key} describes a sweep of {len(key_values)} values, use sweep_from_config_section")
+            values[key] = key_values[0]
+        return cls.from_config_values(config_section, values)
+
+    @classmethod
+    def sweep_from_config_section(cls, config_section, zipped=False):
+        """Generator of the modifications described by a section whose entries can be lists or ranges of values.
+        The combinations are expanded lazily, as cartesian product or, if zipped is True, element-wise"""
+        entries = cls.get_config_entries(config_section)
+        keys = [key for key, _ in entries]
+        for combination in cls.combine_values([key_values for _, key_values in entries], zipped):
+            yield cls.from_config_values(config_section, dict(zip(keys, combination)))
+
     def add_density(self, value, absolute):
         """Adds a modification of the density"""
         self.density = ModificationType(value, absolute)
@@ -99,10 +134,39 @@ class Modification:
         """Adds a modification of the position of the origin"""
         self.position = ModificationType(value, absolute)
 
+    def add_position_vector(self, value, absolute=True, mask=None):
+        """Adds a modification of the three coordinates of the origin position at once.
+        Mask should be an array of 3 truthy/falsy values selecting which coordinates are modified"""
+        value = list(value)
+        if len(value) != 3:
+            raise Exception("Invalid position vector, expected array with 3 values")
+        if mask is not None:
+            mask = list(mask)
+            if len(mask) != 3:
+                raise Exception("Invalid Position Mask parameter, expected array with 3 values")
+            self.position_mask = mask
+        self.position_vector = ModificationType(value, absolute)
+
     def add_joint_type(self, value):
         """Adds a modification of the type of joint (revolute, fixed, etc)"""
         self.joint_type = value
 
+    def to_canonical(self):
+        """Returns a dictionary describing the modification that can be serialized to JSON. Equal modifications
+        give equal dictionaries, e.g. to compute cache keys"""
+        canonical = {}
+        for name in ['mass', 'density', 'dimension', 'radius', 'position', 'position_vector']:
+            modification_type = getattr(self, name)
+            if modification_type is not None:
+                value = [float(item) for item in modification_type.value] if name == 'position_vector' else float(modification_type.value)
+                canonical[name] = [value, bool(modification_type.absolute)]
+        if self.position_vector is not None:
+            canonical['position_mask'] = [bool(item) for item in self.position_mask]
+        if self.joint_type is not None:
+            canonical['joint_type'] = str(self.joint_type)
+        canonical['offset_mask'] = [bool(item) for item in self.offset_mask]
+        return canonical
+
     def __str__(self):
         print_message = "Modification class with the following parameters: "
         if self.mass:
@@ -115,6 +179,8 @@ class Modification:
             print_message += f"{'Absolute' if self.radius.absolute else 'Relative'} modification of radius with value {self.radius.value}. "
         if self.position:
             print_message += f"{'Absolute' if self.position.absolute else 'Relative'} modification of origin position with value {self.position.value}."
+        if self.position_vector:
+            print_message += f"{'Absolute' if self.position_vector.absolute else 'Relative'} modification of origin position vector with value {self.position_vector.value} and mask {self.position_mask}."
         if self.joint_type: 
             print_message += f"Joint Type "+ self.joint_type
         return print_message
@@ -0,0 +1,127 @@
+from contextlib import contextmanager
+from urdfModifiers.core.modifier import attach_observer, detach_observer, notify_observers
+from urdfModifiers.geometry.geometry import ElementField
+
+def _get_geometry_state(geometry_holder):
+    geometry = geometry_holder.geometry
+    if geometry.box is not None:
+        return geometry.box.size.copy()
+    if geometry.cylinder is not None:
+        return (geometry.cylinder.radius, geometry.cylinder.length)
+    if geometry.sphere is not None:
+        return geometry.sphere.radius
+
+def _set_geometry_state(geometry_holder, state):
+    geometry = geometry_holder.geometry
+    if geometry.box is not None:
+        geometry.box.size = state
+    elif geometry.cylinder is not None:
+        geometry.cylinder.radius, geometry.cylinder.length = state
+    elif geometry.sphere is not None:
+        geometry.sphere.radius = state
+
+def _set_inertia(link, inertia):
+    link.inertial.inertia[:, :] = inertia
+
+def _set_joint_type(joint, joint_type):
+    joint.joint_type = joint_type
+
+def _set_joint_origin(joint, origin):
+    joint.origin = origin
+
+def _set_mass(link, mass):
+    link.inertial.mass = mass
+
+def _set_inertial_origin(link, origin):
+    link.inertial.origin = origin
+
+def _set_visual_origin(link, origin):
+    link.visuals[0].origin = origin
+
+def _set_collision_origin(link, origin):
+    link.collisions[0].origin = origin
+
+def _set_visual_geometry(link, state):
+    _set_geometry_state(link.visuals[0], state)
+
+def _set_collision_geometry(link, state):
+    _set_geometry_state(link.collisions[0], state)
+
+# Functions reading a copy of every ElementField and writing it back
+_field_accessors = {
+    ElementField.JOINT_ORIGIN: (lambda joint: joint.origin.copy(), _set_joint_origin),
+    ElementField.JOINT_TYPE: (lambda joint: joint.joint_type, _set_joint_type),
+    ElementField.MASS: (lambda link: link.inertial.mass, _set_mass),
+    ElementField.INERTIA: (lambda link: link.inertial.inertia.copy(), _set_inertia),
+    ElementField.INERTIAL_ORIGIN: (lambda link: link.inertial.origin.copy(), _set_inertial_origin),
+    ElementField.VISUAL_ORIGIN: (lambda link: link.visuals[0].origin.copy(), _set_visual_origin),
+    ElementField.COLLISION_ORIGIN: (lambda link: link.collisions[0].origin.copy(), _set_collision_origin),
+    ElementField.VISUAL_GEOMETRY: (lambda link: _get_geometry_state(link.visuals[0]), _set_visual_geometry),
+    ElementField.COLLISION_GEOMETRY: (lambda link: _get_geometry_state(link.collisions[0]), _set_collision_geometry),
+}
+
+def get_field_value(element, field):
+    """Returns a copy of the value of the field of a link or joint"""
+    get_value, _ = _field_accessors[field]
+    return get_value(element)
+
+def set_field_value(element, field, value):
+    """Writes the value of the field of a link or joint, without notifying the observers"""
+    _, set_value = _field_accessors[field]
+    set_value(element, value)
+
+class ModificationJournal():
+    """Class recording the original value of every field that modifiers overwrite in a robot.
+    It observes the links and joints of the robot and copies a field only the first time it changes, so that
+    rollback restores the original robot in time proportional to the number of changed fields"""
+    def __init__(self, robot):
+        self.robot = robot
+        self.original_values = {}
+        self.is_rolling_back = False
+        for element in self.robot.links + self.robot.joints:
+            attach_observer(element, self)
+
+    def detach(self):
+        """Stops observing the robot elements"""
+        for element in self.robot.links + self.robot.joints:
+            detach_observer(element, self)
+
+    def on_element_change(self, element, field):
+        if self.is_rolling_back or (element, field) in self.original_values:
+            return
+        self.original_values[(element, field)] = get_field_value(element, field)
+
+    @property
+    def touched(self):
+        """Returns the (element, field) pairs changed since the journal was created or last cleared"""
+        return list(self.original_values)
+
+    def __len__(self):
+        return len(self.original_values)
+
+    def commit(self):
+        """Keeps the current state of the robot, forgetting the recorded values"""
+        self.original_values = {}
+
+    def rollback(self):
+        """Restores every changed field to its recorded value. Other observers are notified of the restored fields,
+        so that caches such as PoseCache are kept up to date"""
+        self.is_rolling_back = True
+        try:
+            for (element, field), value in reversed(list(self.original_values.items())):
+                notify_observers(element, field)
+                set_field_value(element, field, value)
+        finally:
+            self.is_rolling_back = False
+        self.original_values = {}
+
+@contextmanager
+def robot_transaction(robot):
+    """Context manager yielding a ModificationJournal of the robot, whose changes are rolled back on exit
+    unless the journal is committed inside the block"""
+    journal = ModificationJournal(robot)
+    try:
+        yield journal
+    finally:
+        journal.rollback()
+        journal.detach()
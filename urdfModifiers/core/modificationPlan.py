@@ -0,0 +1,178 @@
+from dataclasses import dataclass
+from urdfModifiers.core.evaluation import RobotEvaluation, ShadowRobot
+from urdfModifiers.core.fixedOffsetModifier import FixedOffsetModifier
+from urdfModifiers.core.jointModifier import JointModifier
+from urdfModifiers.core.linkModifier import LinkModifier
+from urdfModifiers.core.modification import Modification
+from urdfModifiers.core.robotIndex import RobotIndex
+from urdfModifiers.geometry.geometry import Limb, Side
+
+@dataclass
+class ModificationStep():
+    """Class describing one element of a ModificationPlan and the modification to perform on it"""
+    element_name: str
+    modification: Modification
+    section_name: str = None
+
+class ModificationPlan():
+    """Class holding the modifications of a configuration file already parsed and resolved to element names.
+    Once bound to a robot, the modifiers of every element are created once, so that apply only runs the modifications.
+    The plan can be pickled (e.g. to send it to worker processes): the modifiers are dropped and recreated on the next apply"""
+    def __init__(self, steps=None, axis=Side.Z, keep_offsets=False):
+        self.steps = list(steps) if steps is not None else []
+        self.axis = axis
+        self.keep_offsets = keep_offsets
+        self.robot = None
+        self.segments = None
+
+    @staticmethod
+    def resolve_section(section_name, selectors=None):
+        """Returns the element names selected by a section. Sections named after a Limb are looked up in selectors,
+        any other section is looked up in selectors and falls back to the element with the same name"""
+        selectors = selectors if selectors is not None else {}
+        if section_name.upper() in Limb:
+            limb = Limb[section_name.upper()]
+            if limb == Limb.NONE:
+                return []
+            if limb not in selectors:
+                raise Exception(f"No elements defined for limb {limb.name}")
+            return list(selectors[limb])
+        return list(selectors.get(section_name, [section_name]))
+
+    @classmethod
+    def compile(cls, config, robot_index=None, selectors=None, axis=Side.Z, keep_offsets=False):
+        """Constructs a plan from a configparser.ConfigParser class (or a dictionary of sections), parsing every section once.
+        selectors maps section names or Limb values to lists of element names.
+        If robot_index is given, every element is checked and the plan is bound to its robot"""
+        section_names = config.sections() if hasattr(config, 'sections') else list(config)
+        steps = []
+        for section_name in section_names:
+            modification = Modification.from_config_section(config[section_name])
+            for element_name in cls.resolve_section(section_name, selectors):
+                steps.append(ModificationStep(element_name, modification, section_name))
+        plan = cls(steps, axis, keep_offsets)
+        if robot_index is not None:
+            plan.bind(robot_index.robot, robot_index)
+        return plan
+
+    @classmethod
+    def sweep(cls, config, selectors=None, zipped=False, axis=Side.Z, keep_offsets=False):
+        """Generator of the plans described by a configuration whose entries can be lists or ranges of values, e.g.
+        dimension_scale = linspace(0.8, 1.2, 21). The swept entries of all sections are combined lazily, as cartesian
+        product or, if zipped is True, element-wise, so that the full grid is never stored in memory"""
+        section_names = config.sections() if hasattr(config, 'sections') else list(config)
+        sections = []
+        value_lists = []
+        for section_name in section_names:
+            entries = Modification.get_config_entries(config[section_name])
+            sections.append((section_name, config[section_name], [key for key, _ in entries], cls.resolve_section(section_name, selectors)))
+            value_lists += [key_values for _, key_values in entries]
+        for combination in Modification.combine_values(value_lists, zipped):
+            steps = []
+            first_value = 0
+            for section_name, config_section, keys, element_names in sections:
+                values = dict(zip(keys, combination[first_value:first_value + len(keys)]))
+                first_value += len(keys)
+                modification = Modification.from_config_values(config_section, values)
+                steps += [ModificationStep(element_name, modification, section_name) for element_name in element_names]
+            yield cls(steps, axis, keep_offsets)
+
+    @classmethod
+    def from_modifications(cls, modifications, robot_index=None, axis=Side.Z, keep_offsets=False):
+        """Constructs a plan from a dictionary mapping element names to Modification classes"""
+        plan = cls([ModificationStep(element_name, modification) for element_name, modification in modifications.items()], axis, keep_offsets)
+        if robot_index is not None:
+            plan.bind(robot_index.robot, robot_index)
+        return plan
+
+    def get_element_names(self, robot_index):
+        """Returns the names of the links and joints that apply can change: the elements of the steps and,
+        if offsets are kept, the joints attached to their links"""
+        element_names = set()
+        for step in self.steps:
+            element_names.add(step.element_name)
+            if self.keep_offsets and robot_index.get_link(step.element_name) is not None:
+                parent_joint = robot_index.get_parent_joint(step.element_name)
+                if parent_joint is not None:
+                    element_names.add(parent_joint.name)
+                element_names.update(joint.name for joint in robot_index.get_child_joints(step.element_name))
+        return element_names
+
+    def create_modifier(self, element_name, robot, robot_index, joint_modifier_map):
+        """Returns the modifier of the link or joint of the robot named element_name"""
+        link = robot_index.get_link(element_name)
+        if link is not None:
+            if self.keep_offsets:
+                return FixedOffsetModifier(link, robot, self.axis, robot_index, joint_modifier_map)
+            return LinkModifier(link, self.axis)
+        joint = robot_index.get_joint(element_name)
+        if joint is None:
+            raise Exception(f"Element {element_name} not found in the robot")
+        return JointModifier(joint, self.axis)
+
+    def bind(self, robot, robot_index=None):
+        """Resolves every element of the plan to its modifier in the robot and groups the steps in segments, in which
+        the modifications of each element are fused. If offsets are kept, a link step following a step on one of the
+        child joints of the link starts a new segment, since the link moves its child joints. It is called automatically
+        by apply whenever the robot changes"""
+        if robot_index is None:
+            robot_index = RobotIndex(robot)
+        modifiers = {}
+        joint_modifier_map = {}
+        segments = [{}]
+        segment_joint_names = set()
+        for step in self.steps:
+            if step.element_name not in modifiers:
+                modifiers[step.element_name] = self.create_modifier(step.element_name, robot, robot_index, joint_modifier_map)
+            modifier = modifiers[step.element_name]
+            if isinstance(modifier, JointModifier):
+                segment_joint_names.add(step.element_name)
+            elif self.keep_offsets and any(joint.name in segment_joint_names for joint in modifier.child_joint_list):
+                segments.append({})
+                segment_joint_names = set()
+            segments[-1].setdefault(step.element_name, (modifier, []))[1].append(step.modification)
+        self.segments = [list(segment.values()) for segment in segments]
+        self.robot = robot
+
+    def apply(self, robot, robot_index=None):
+        """Performs the modifications of the plan on the robot, with the same result as performing the steps in the order
+        of the plan. All the modifications of an element in a segment (e.g. from a Limb section and from its own section)
+        are fused, so that each element is updated once per segment, usually once. If offsets are kept, the links of
+        each segment are modified together with FixedOffsetModifier.modify_many, and then its joints"""
+        if robot is not self.robot:
+            self.bind(robot, robot_index)
+        for segment in self.segments:
+            if not self.keep_offsets:
+                for modifier, modifications in segment:
+                    modifier.modify_all(modifications)
+                continue
+            link_items = [(modifier, modifications) for modifier, modifications in segment if isinstance(modifier, FixedOffsetModifier)]
+            FixedOffsetModifier.modify_many([modifier for modifier, _ in link_items], [modifications for _, modifications in link_items])
+            for modifier, modifications in segment:
+                if not isinstance(modifier, FixedOffsetModifier):
+                    modifier.modify_all(modifications)
+
+    def evaluate(self, robot, robot_index=None):
+        """Returns the RobotEvaluation that apply would produce. The plan is applied to a ShadowRobot copying only
+        the elements returned by get_element_names, so the robot is left untouched"""
+        if robot_index is None:
+            robot_index = RobotIndex(robot)
+        shadow_robot = ShadowRobot(robot, self.get_element_names(robot_index))
+        self.apply(shadow_robot)
+        return RobotEvaluation.from_robot(shadow_robot)
+
+    def to_canonical(self):
+        """Returns a dictionary describing the plan that can be serialized to JSON: the axis, the modifier used for
+        links and the modification of every step, in order"""
+        return {"axis": self.axis.name,
+                "link_modifier": FixedOffsetModifier.__name__ if self.keep_offsets else LinkModifier.__name__,
+                "steps": [[step.element_name, step.modification.to_canonical()] for step in self.steps]}
+
+    def __len__(self):
+        return len(self.steps)
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['robot'] = None
+        state['segments'] = None
+        return state
@@ -1,4 +1,81 @@
 from abc import ABCMeta, abstractmethod
+import weakref
+from urdfModifiers.geometry.geometry import Side
+
+# Weak references to the observers of every element, keyed weakly by the element. Observers usually reference the robot,
+# so holding either of them strongly would keep the robot alive after its last use
+_element_observers = weakref.WeakKeyDictionary()
+
+# Name of the robot attribute holding the objects attached by set_robot_attachment
+_ROBOT_ATTACHMENTS = '_urdf_modifiers_attachments'
+
+def attach_observer(element, observer):
+    """Registers an observer whose on_element_change(element, field) method is called before a modifier changes a field
+    of the element. The observer is held weakly: it is notified as long as its owner keeps it alive"""
+    _element_observers.setdefault(element, []).append(weakref.ref(observer))
+
+def detach_observer(element, observer):
+    """Unregisters an observer previously attached to the element"""
+    observer_refs = _element_observers.get(element)
+    if observer_refs:
+        observer_refs[:] = [observer_ref for observer_ref in observer_refs if observer_ref() is not None and observer_ref() is not observer]
+
+def notify_observers(element, field):
+    """Notifies the observers of the element that the given ElementField is about to change"""
+    observer_refs = _element_observers.get(element)
+    if not observer_refs:
+        return
+    collected = False
+    for observer_ref in list(observer_refs):
+        observer = observer_ref()
+        if observer is None:
+            collected = True
+        else:
+            observer.on_element_change(element, field)
+    if collected:
+        observer_refs[:] = [observer_ref for observer_ref in observer_refs if observer_ref() is not None]
+
+class _RobotAttachments(dict):
+    """Dictionary of the objects attached to a robot, stored on the robot itself so that they are collected with it.
+    Copies of the robot do not share the attachments, which observe the elements of the original robot"""
+    def __init__(self, robot=None):
+        super().__init__()
+        self.robot_ref = weakref.ref(robot) if robot is not None else lambda: None
+
+    def __copy__(self):
+        return _RobotAttachments()
+
+    def __deepcopy__(self, memo):
+        return _RobotAttachments()
+
+    def __reduce__(self):
+        return (_RobotAttachments, ())
+
+def _get_robot_attachments(robot):
+    attachments = getattr(robot, _ROBOT_ATTACHMENTS, None)
+    # A shallow copy of the robot shares the attribute values of the original one
+    if attachments is None or attachments.robot_ref() is not robot:
+        return None
+    return attachments
+
+def get_robot_attachment(robot, key):
+    """Returns the object attached to the robot with the given key, or None"""
+    attachments = _get_robot_attachments(robot)
+    return attachments.get(key) if attachments is not None else None
+
+def set_robot_attachment(robot, key, value):
+    """Attaches an object (e.g. the PoseCache of the robot) to the robot, keeping it alive as long as the robot"""
+    attachments = _get_robot_attachments(robot)
+    if attachments is None:
+        attachments = _RobotAttachments(robot)
+        setattr(robot, _ROBOT_ATTACHMENTS, attachments)
+    attachments[key] = value
+
+def remove_robot_attachment(robot, key, value):
+    """Removes the object attached to the robot with the given key, if it is value"""
+    attachments = _get_robot_attachments(robot)
+    if attachments is not None and attachments.get(key) is value:
+        del attachments[key]
 
 class Modifier(metaclass=ABCMeta):
     """Class to contain information and methods on how to modify a URDF element"""
@@ -9,3 +86,17 @@ class Modifier(metaclass=ABCMeta):
     @abstractmethod
     def modify(self, modifications):
         pass
+
+    def notify_change(self, field):
+        """Notifies the observers of the modified element that the given ElementField is about to change"""
+        notify_observers(self.element, field)
+
+    @staticmethod
+    def get_axis_index(axis):
+        """Returns the index of the coordinate (row of the origin translation column) that corresponds to the axis"""
+        if axis == Side.X:
+            return 0
+        elif axis == Side.Y:
+            return 1
+        elif axis == Side.Z:
+            return 2
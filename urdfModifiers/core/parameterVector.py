@@ -0,0 +1,134 @@
+from dataclasses import dataclass
+import numpy as np
+from urdfModifiers.core.fixedOffsetModifier import FixedOffsetModifier
+from urdfModifiers.core.inertiaBatch import InertiaBatch
+from urdfModifiers.core.jointModifier import JointModifier
+from urdfModifiers.core.linkModifier import LinkModifier
+from urdfModifiers.core.robotIndex import RobotIndex
+from urdfModifiers.geometry.geometry import Geometry, ParameterType, RobotElement, Side
+
+@dataclass
+class Parameter():
+    """Class describing one entry of a ParameterVector"""
+    element_name: str
+    element_type: RobotElement
+    parameter_type: ParameterType
+    axis: Side = None
+    keep_offsets: bool = False
+    offset_mask: list = None
+
+    @property
+    def name(self):
+        """Returns a readable name of the parameter, e.g. r_upper_arm.length or r_elbow.position.x"""
+        suffix = f".{self.axis.name.lower()}" if self.parameter_type == ParameterType.POSITION and self.axis is not None else ""
+        return f"{self.element_name}.{self.parameter_type.name.lower()}{suffix}"
+
+class ParameterVector():
+    """Class mapping named link and joint quantities to the slots of a flat numpy vector, e.g. the decision vector of an optimizer.
+    Parameters are grouped by type (structure of arrays) and the modifiers of the bound robot are created once, so that
+    extract and apply only read and write numeric fields, without creating a Modification per parameter"""
+    def __init__(self):
+        self.parameters = []
+        self.robot = None
+
+    def add_link_parameter(self, link_name, parameter_type, axis=Side.Z, keep_offsets=False, offset_mask=None):
+        """Adds a link quantity (length, radius, density, mass or origin position along axis) and returns its slot.
+        If keep_offsets is True, length changes are performed by a FixedOffsetModifier, keeping the offsets in offset_mask (all by default)"""
+        offset_mask = [1,1,1] if offset_mask is None else list(offset_mask)
+        self.parameters.append(Parameter(link_name, RobotElement.LINK, parameter_type, axis, keep_offsets, offset_mask))
+        self.robot = None
+        return len(self.parameters) - 1
+
+    def add_joint_parameter(self, joint_name, axis):
+        """Adds the origin position of a joint along axis and returns its slot"""
+        self.parameters.append(Parameter(joint_name, RobotElement.JOINT, ParameterType.POSITION, axis))
+        self.robot = None
+        return len(self.parameters) - 1
+
+    @property
+    def names(self):
+        """Returns the names of the parameters, in slot order"""
+        return [parameter.name for parameter in self.parameters]
+
+    def __len__(self):
+        return len(self.parameters)
+
+    def bind(self, robot, robot_index=None):
+        """Resolves every parameter to the modifier of its element in the robot, grouping the slots by parameter type.
+        It is called automatically by extract and apply whenever the robot changes"""
+        if robot_index is None:
+            robot_index = RobotIndex(robot)
+        self.slots = {parameter_type: [] for parameter_type in ParameterType}
+        self.modifiers = {parameter_type: [] for parameter_type in ParameterType}
+        geometry_links = {}
+        mass_links = {}
+        joint_modifier_map = {}
+        for slot, parameter in enumerate(self.parameters):
+            if parameter.element_type == RobotElement.JOINT:
+                element = robot_index.get_joint(parameter.element_name)
+            else:
+                element = robot_index.get_link(parameter.element_name)
+            if element is None:
+                raise Exception(f"Element {parameter.element_name} not found in the robot")
+            if parameter.element_type == RobotElement.JOINT:
+                modifier = JointModifier(element, parameter.axis)
+            elif parameter.parameter_type == ParameterType.LENGTH and parameter.keep_offsets:
+                modifier = FixedOffsetModifier(element, robot, parameter.axis, robot_index, joint_modifier_map)
+            else:
+                modifier = LinkModifier(element, parameter.axis)
+                geometry_type, _ = modifier.get_geometry(modifier.get_visual())
+                if parameter.parameter_type == ParameterType.LENGTH and geometry_type == Geometry.SPHERE:
+                    raise Exception('Cannot modify length of sphere geometry')
+            if parameter.parameter_type in (ParameterType.LENGTH, ParameterType.RADIUS):
+                geometry_links[element.name] = element
+            elif parameter.parameter_type in (ParameterType.DENSITY, ParameterType.MASS):
+                mass_links[element.name] = element
+            self.slots[parameter.parameter_type].append(slot)
+            self.modifiers[parameter.parameter_type].append(modifier)
+        self.slots = {parameter_type: np.array(slots, dtype=int) for parameter_type, slots in self.slots.items()}
+        self.geometry_batch = InertiaBatch([LinkModifier(link) for link in geometry_links.values()])
+        self.mass_batch = InertiaBatch([LinkModifier(link) for name, link in mass_links.items() if name not in geometry_links])
+        self.robot = robot
+
+    def _ensure_bound(self, robot):
+        if robot is not self.robot:
+            self.bind(robot)
+
+    def extract(self, robot):
+        """Returns the current value of every parameter in the robot as a flat numpy vector"""
+        self._ensure_bound(robot)
+        x = np.zeros(len(self.parameters))
+        x[self.slots[ParameterType.LENGTH]] = [modifier.get_significant_length() for modifier in self.modifiers[ParameterType.LENGTH]]
+        x[self.slots[ParameterType.RADIUS]] = [modifier.get_radius() for modifier in self.modifiers[ParameterType.RADIUS]]
+        x[self.slots[ParameterType.DENSITY]] = [modifier.calculate_density() for modifier in self.modifiers[ParameterType.DENSITY]]
+        x[self.slots[ParameterType.MASS]] = [modifier.get_mass() for modifier in self.modifiers[ParameterType.MASS]]
+        x[self.slots[ParameterType.POSITION]] = [modifier.get_origin_position() for modifier in self.modifiers[ParameterType.POSITION]]
+        return x
+
+    def apply(self, robot, x):
+        """Writes the flat vector x into the robot. Geometry is written first, then densities and masses, and finally
+        the inertias are recomputed in batch for links whose geometry changed and rescaled for links whose mass changed"""
+        self._ensure_bound(robot)
+        x = np.asarray(x, dtype=float)
+        if len(x) != len(self.parameters):
+            raise Exception(f"Invalid parameter vector, expected array with {len(self.parameters)} values")
+        self.mass_batch.pack()
+
+        for slot, modifier in zip(self.slots[ParameterType.LENGTH], self.modifiers[ParameterType.LENGTH]):
+            if isinstance(modifier, FixedOffsetModifier):
+                modifier.change_dimension_and_keep_offsets(x[slot], self.parameters[slot].offset_mask)
+            else:
+                modifier.set_length(x[slot])
+        for value, modifier in zip(x[self.slots[ParameterType.RADIUS]], self.modifiers[ParameterType.RADIUS]):
+            modifier.set_radius(value)
+        for value, modifier in zip(x[self.slots[ParameterType.DENSITY]], self.modifiers[ParameterType.DENSITY]):
+            modifier.set_density(value)
+        for value, modifier in zip(x[self.slots[ParameterType.MASS]], self.modifiers[ParameterType.MASS]):
+            modifier.set_mass(value)
+        for value, modifier in zip(x[self.slots[ParameterType.POSITION]], self.modifiers[ParameterType.POSITION]):
+            modifier.set_origin_position(value)
+
+        self.geometry_batch.pack()
+        self.geometry_batch.update_inertias()
+        self.mass_batch.rescale_inertias([link_modifier.get_mass() for link_modifier in self.mass_batch.link_modifiers])
+        self.mass_batch.write_back()
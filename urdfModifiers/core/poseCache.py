@@ -0,0 +1,78 @@
+import numpy as np
+from urdfModifiers.core.modifier import attach_observer, detach_observer, get_robot_attachment, remove_robot_attachment, set_robot_attachment
+from urdfModifiers.core.robotIndex import RobotIndex
+from urdfModifiers.geometry.geometry import ElementField
+
+class PoseCache():
+    """Class caching the pose of every link and joint w.r.t. the root link frame, at the zero joint configuration.
+    It observes the joints of the robot, so that a joint origin change made by a modifier only marks the subtree
+    below that joint as dirty. Poses are then recomputed lazily, starting from the closest clean ancestor"""
+    def __init__(self, robot, robot_index=None):
+        self.robot = robot
+        self.robot_index = robot_index if robot_index is not None else RobotIndex(robot)
+        self.link_poses = {}
+        self.dirty_links = set(self.robot_index.link_map)
+        for joint in self.robot.joints:
+            attach_observer(joint, self)
+
+    @classmethod
+    def of(cls, robot, robot_index=None):
+        """Returns the pose cache attached to the robot, creating it on first use"""
+        instance = get_robot_attachment(robot, cls)
+        if instance is None:
+            instance = cls(robot, robot_index)
+            set_robot_attachment(robot, cls, instance)
+        return instance
+
+    def detach(self):
+        """Stops observing the robot joints and removes the cache from the robot"""
+        for joint in self.robot.joints:
+            detach_observer(joint, self)
+        remove_robot_attachment(self.robot, type(self), self)
+
+    def on_element_change(self, element, field):
+        if field == ElementField.JOINT_ORIGIN:
+            self.mark_subtree_dirty(element.child)
+
+    def invalidate(self):
+        """Marks every pose as dirty, e.g. after structural changes of the robot"""
+        self.robot_index.invalidate()
+        self.dirty_links = set(link.name for link in self.robot.links)
+
+    def mark_subtree_dirty(self, link_name):
+        """Marks the link and every link below it as dirty. Subtrees of dirty links are dirty already, so they are not visited again"""
+        links_to_visit = [link_name]
+        while links_to_visit:
+            current_link_name = links_to_visit.pop()
+            if current_link_name in self.dirty_links:
+                continue
+            self.dirty_links.add(current_link_name)
+            links_to_visit += [joint.child for joint in self.robot_index.get_child_joints(current_link_name)]
+
+    def get_link_pose(self, link_name):
+        """Returns the 4x4 pose of the link frame w.r.t. the root link frame"""
+        dirty_chain = []
+        current_link_name = link_name
+        while current_link_name in self.dirty_links:
+            dirty_chain.append(current_link_name)
+            parent_joint = self.robot_index.get_parent_joint(current_link_name)
+            if parent_joint is None:
+                break
+            current_link_name = parent_joint.parent
+
+        for current_link_name in reversed(dirty_chain):
+            parent_joint = self.robot_index.get_parent_joint(current_link_name)
+            if parent_joint is None:
+                self.link_poses[current_link_name] = np.eye(4)
+            else:
+                self.link_poses[current_link_name] = np.dot(self.link_poses[parent_joint.parent], parent_joint.origin)
+            self.dirty_links.discard(current_link_name)
+        return self.link_poses[link_name]
+
+    def get_joint_pose(self, joint_name):
+        """Returns the 4x4 pose of the joint frame (which is its child link frame) w.r.t. the root link frame"""
+        return self.get_link_pose(self.robot_index.get_joint(joint_name).child)
+
+    def get_link_poses(self):
+        """Returns a dictionary with the pose of every link"""
+        return {link.name: self.get_link_pose(link.name) for link in self.robot.links}
@@ -0,0 +1,81 @@
+class RobotIndex():
+    """Class indexing the links and joints of a robot by name, together with the parent/child joint adjacency of its tree.
+    It is meant to be built once per robot and shared among modifiers, instead of scanning the robot on every lookup"""
+    def __init__(self, robot):
+        self.robot = robot
+        self.rebuild()
+
+    def rebuild(self):
+        """Builds the name and adjacency maps from the current links and joints of the robot"""
+        self.link_map = {}
+        self.joint_map = {}
+        self.parent_joint_map = {}
+        self.child_joints_map = {}
+        for link in self.robot.links:
+            self.link_map.setdefault(link.name, link)
+        for joint in self.robot.joints:
+            self.joint_map.setdefault(joint.name, joint)
+            self._add_adjacency(joint)
+        self.is_valid = True
+
+    def invalidate(self):
+        """Marks the index as outdated, so that it is rebuilt on the next lookup"""
+        self.is_valid = False
+
+    def _ensure_valid(self):
+        if not self.is_valid:
+            self.rebuild()
+
+    def _add_adjacency(self, joint):
+        self.parent_joint_map.setdefault(joint.child, joint)
+        self.child_joints_map.setdefault(joint.parent, []).append(joint)
+
+    def _remove_adjacency(self, joint):
+        if self.parent_joint_map.get(joint.child) is joint:
+            del self.parent_joint_map[joint.child]
+        siblings = self.child_joints_map.get(joint.parent, [])
+        if joint in siblings:
+            siblings.remove(joint)
+
+    def get_link(self, link_name):
+        """Returns the link whose name matches the argument, None if it does not exist"""
+        self._ensure_valid()
+        return self.link_map.get(link_name)
+
+    def get_joint(self, joint_name):
+        """Returns the joint whose name matches the argument, None if it does not exist"""
+        self._ensure_valid()
+        return self.joint_map.get(joint_name)
+
+    def get_element(self, element_name):
+        """Returns the link whose name matches the argument, or the joint if there is no such link"""
+        link = self.get_link(element_name)
+        return link if link is not None else self.get_joint(element_name)
+
+    def get_parent_joint(self, link_name):
+        """Returns the joint having the link as child, None for the root link"""
+        self._ensure_valid()
+        return self.parent_joint_map.get(link_name)
+
+    def get_child_joints(self, link_name):
+        """Returns the list of joints having the link as parent"""
+        self._ensure_valid()
+        return list(self.child_joints_map.get(link_name, []))
+
+    def rename_joint(self, joint, new_name):
+        """Renames a joint, keeping the index up to date"""
+        self._ensure_valid()
+        if self.joint_map.get(joint.name) is joint:
+            del self.joint_map[joint.name]
+        joint.name = new_name
+        self.joint_map.setdefault(new_name, joint)
+
+    def reparent_joint(self, joint, parent_link_name=None, child_link_name=None):
+        """Moves a joint to a new parent and/or child link, keeping the index up to date"""
+        self._ensure_valid()
+        self._remove_adjacency(joint)
+        if parent_link_name is not None:
+            joint.parent = parent_link_name
+        if child_link_name is not None:
+            joint.child = child_link_name
+        self._add_adjacency(joint)
@@ -45,3 +45,22 @@ class RobotElement(Enum):
     LINK = auto()
     JOINT = auto()
 
+class ParameterType(Enum):
+    """The quantities that can be exposed as entries of a parameter vector"""
+    LENGTH = auto()
+    RADIUS = auto()
+    DENSITY = auto()
+    MASS = auto()
+    POSITION = auto()
+
+class ElementField(Enum):
+    """The fields of links and joints that modifiers can change, reported to the observers of the elements"""
+    JOINT_ORIGIN = auto()
+    JOINT_TYPE = auto()
+    MASS = auto()
+    INERTIA = auto()
+    INERTIAL_ORIGIN = auto()
+    VISUAL_ORIGIN = auto()
+    COLLISION_ORIGIN = auto()
+    VISUAL_GEOMETRY = auto()
+    COLLISION_GEOMETRY = auto()
@@ -4,4 +4,8 @@
 # This software may be modified and distributed under the terms of the
 # BSD-3-Clause license. See the accompanying LICENSE file for details.
 
-from . import utils
\ No newline at end of file
+from . import utils
+from . import variants
+from . import patch
+from . import document
+from . import cache
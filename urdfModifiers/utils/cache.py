@@ -0,0 +1,155 @@
+from collections import OrderedDict
+import hashlib
+import io
+import json
+import os
+from urdfModifiers.core.modificationJournal import ModificationJournal
+from urdfModifiers.core.modificationPlan import ModificationPlan
+from urdfModifiers.utils.patch import create_patch
+from urdfModifiers.utils.utils import load_robot_and_gazebo_plugins_from_bytes, write_urdf_to_stream
+
+class VariantCache():
+    """Class storing generated variants (URDF or patch content) by a hash of the base URDF bytes and of the canonical
+    form of the applied modifications, offset masks and modifier type included, so that the same variant is generated once.
+    Variants are kept in cache_dir, which can be shared among runs and processes, evicting the least recently used ones
+    above max_bytes, and the most recently used ones are also kept in memory up to max_memory_bytes"""
+    def __init__(self, cache_dir, max_bytes=1 << 30, max_memory_bytes=64 << 20):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.max_memory_bytes = max_memory_bytes
+        self.memory = OrderedDict()
+        self.memory_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(cache_dir, exist_ok=True)
+        self.disk_bytes = sum(size for _, _, size in self.get_entries())
+
+    @staticmethod
+    def get_key(base_bytes, modification_set, patch=False):
+        """Returns the key of the variant obtained applying modification_set (a ModificationPlan or a dictionary mapping
+        element names to Modification classes) to the base URDF content"""
+        plan = VariantCache.as_plan(modification_set)
+        description = json.dumps({"output": "patch" if patch else "urdf", "plan": plan.to_canonical()}, sort_keys=True, separators=(',', ':'))
+        key = hashlib.sha256(hashlib.sha256(base_bytes).digest())
+        key.update(description.encode('utf-8'))
+        return key.hexdigest()
+
+    @staticmethod
+    def as_plan(modification_set):
+        if isinstance(modification_set, ModificationPlan):
+            return modification_set
+        return ModificationPlan.from_modifications(modification_set)
+
+    def get_path(self, key):
+        return os.path.join(self.cache_dir, key[:2], key)
+
+    def get_entries(self):
+        """Returns the (path, last use time, size) of every variant stored on disk"""
+        entries = []
+        for directory, _, file_names in os.walk(self.cache_dir):
+            for file_name in file_names:
+                # Files still being written by put, possibly by other processes, are neither counted nor evicted
+                if file_name.endswith('.tmp'):
+                    continue
+                path = os.path.join(directory, file_name)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                entries.append((path, stat.st_mtime, stat.st_size))
+        return entries
+
+    def _remember(self, key, data):
+        if key in self.memory:
+            self.memory_bytes -= len(self.memory.pop(key))
+        self.memory[key] = data
+        self.memory_bytes += len(data)
+        while self.memory_bytes > self.max_memory_bytes and self.memory:
+            _, evicted_data = self.memory.popitem(last=False)
+            self.memory_bytes -= len(evicted_data)
+
+    @staticmethod
+    def _touch(path):
+        # The modification time marks the last use of the variant for the eviction
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            pass
+
+    def get(self, key):
+        """Returns the stored variant, or None if the key is not in the cache"""
+        path = self.get_path(key)
+        if key in self.memory:
+            self.memory.move_to_end(key)
+            self._touch(path)
+            return self.memory[key]
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+        except FileNotFoundError:
+            return None
+        self._touch(path)
+        self._remember(key, data)
+        return data
+
+    def put(self, key, data):
+        """Stores the variant content, evicting the least recently used variants if the cache is full"""
+        path = self.get_path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        try:
+            self.disk_bytes -= os.path.getsize(path)
+        except FileNotFoundError:
+            pass
+        temporary_path = f"{path}.{os.getpid()}.tmp"
+        with open(temporary_path, 'wb') as f:
+            f.write(data)
+        os.replace(temporary_path, path)
+        self.disk_bytes += len(data)
+        self._remember(key, data)
+        if self.disk_bytes > self.max_bytes:
+            self.evict()
+
+    def evict(self):
+        """Deletes the least recently used variants until the cache directory fits in max_bytes"""
+        entries = sorted(self.get_entries(), key=lambda entry: entry[1])
+        self.disk_bytes = sum(size for _, _, size in entries)
+        for path, _, size in entries:
+            if self.disk_bytes <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            self.disk_bytes -= size
+            self.memory.pop(os.path.basename(path), None)
+        self.memory_bytes = sum(len(data) for data in self.memory.values())
+
+    def get_or_generate(self, template, modification_set, patch=False):
+        """Returns the content of the variant obtained applying modification_set to the template (a file path).
+        The modifiers run only if the variant is not in the cache. If patch is True, the content is the JSON patch
+        of the variant (see utils.patch.apply_patch), otherwise the URDF with the template <gazebo> blocks"""
+        with open(template, 'rb') as f:
+            template_bytes = f.read()
+        key = self.get_key(template_bytes, modification_set, patch)
+        data = self.get(key)
+        if data is not None:
+            self.hits += 1
+            return data
+
+        self.misses += 1
+        robot, gazebo_blocks = load_robot_and_gazebo_plugins_from_bytes(template_bytes, os.path.dirname(os.path.abspath(template)))
+        journal = ModificationJournal(robot)
+        try:
+            self.as_plan(modification_set).apply(robot)
+            touched = journal.touched
+        finally:
+            journal.detach()
+        if patch:
+            data = json.dumps(create_patch(touched, robot.name), separators=(',', ':')).encode('utf-8')
+        else:
+            stream = io.BytesIO()
+            # Without a path the meshes are written as references to their files, and never exported over the template ones
+            write_urdf_to_stream(robot, stream, gazebo_blocks)
+            data = stream.getvalue()
+        self.put(key, data)
+        return data
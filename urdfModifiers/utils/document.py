@@ -0,0 +1,103 @@
+from lxml import etree
+from urchin import matrix_to_xyz_rpy
+from urdfModifiers.core.modifier import attach_observer, detach_observer
+from urdfModifiers.geometry.geometry import ElementField
+from urdfModifiers.utils.utils import load_robot_from_tree
+import copy
+import os
+
+def _format_values(values):
+    return ' '.join(repr(float(value)) for value in values)
+
+def _get_child(element, tag):
+    child = element.find(tag)
+    if child is None:
+        child = etree.SubElement(element, tag)
+    return child
+
+def _write_origin(element, origin):
+    origin_element = _get_child(element, 'origin')
+    xyz_rpy = matrix_to_xyz_rpy(origin)
+    origin_element.set('xyz', _format_values(xyz_rpy[:3]))
+    # Keep origins without rotation as they were written, without an rpy attribute
+    if origin_element.get('rpy') is not None or any(xyz_rpy[3:]):
+        origin_element.set('rpy', _format_values(xyz_rpy[3:]))
+
+def _write_geometry(element, geometry):
+    geometry_element = element.find('geometry')
+    if geometry.box is not None:
+        geometry_element.find('box').set('size', _format_values(geometry.box.size))
+    elif geometry.cylinder is not None:
+        cylinder_element = geometry_element.find('cylinder')
+        cylinder_element.set('radius', repr(float(geometry.cylinder.radius)))
+        cylinder_element.set('length', repr(float(geometry.cylinder.length)))
+    elif geometry.sphere is not None:
+        geometry_element.find('sphere').set('radius', repr(float(geometry.sphere.radius)))
+
+def _write_inertia(link_element, inertia):
+    inertia_element = _get_child(link_element.find('inertial'), 'inertia')
+    for name, (row, column) in [('ixx', (0, 0)), ('ixy', (0, 1)), ('ixz', (0, 2)), ('iyy', (1, 1)), ('iyz', (1, 2)), ('izz', (2, 2))]:
+        inertia_element.set(name, repr(float(inertia[row, column])))
+
+# Functions writing every ElementField of a link or joint to its XML element
+_field_writers = {
+    ElementField.JOINT_ORIGIN: lambda joint_element, joint: _write_origin(joint_element, joint.origin),
+    ElementField.JOINT_TYPE: lambda joint_element, joint: joint_element.set('type', joint.joint_type),
+    ElementField.MASS: lambda link_element, link: _get_child(link_element.find('inertial'), 'mass').set('value', repr(float(link.inertial.mass))),
+    ElementField.INERTIA: lambda link_element, link: _write_inertia(link_element, link.inertial.inertia),
+    ElementField.INERTIAL_ORIGIN: lambda link_element, link: _write_origin(link_element.find('inertial'), link.inertial.origin),
+    ElementField.VISUAL_ORIGIN: lambda link_element, link: _write_origin(link_element.find('visual'), link.visuals[0].origin),
+    ElementField.COLLISION_ORIGIN: lambda link_element, link: _write_origin(link_element.find('collision'), link.collisions[0].origin),
+    ElementField.VISUAL_GEOMETRY: lambda link_element, link: _write_geometry(link_element.find('visual'), link.visuals[0].geometry),
+    ElementField.COLLISION_GEOMETRY: lambda link_element, link: _write_geometry(link_element.find('collision'), link.collisions[0].geometry),
+}
+
+class UrdfDocument():
+    """Class keeping the parsed XML tree of a URDF next to the robot built from it, so that the robot can be saved
+    without serializing it again. The document observes the links and joints of the robot and, on save, writes only
+    the changed fields to their XML elements. Comments, ordering, <gazebo> blocks and any other tag are kept as they are"""
+    def __init__(self, tree, path='', lazy_load_meshes=False):
+        self.tree = tree
+        root = tree.getroot()
+        # urchin moves the tags it does not know (e.g. <gazebo>) out of the tree, so it parses a copy
+        self.robot = load_robot_from_tree(copy.deepcopy(root), path, lazy_load_meshes)
+        self.link_elements = {element.get('name'): element for element in root.findall('link')}
+        self.joint_elements = {element.get('name'): element for element in root.findall('joint')}
+        self.touched = {}
+        for element in self.robot.links + self.robot.joints:
+            attach_observer(element, self)
+
+    @classmethod
+    def load(cls, urdf_path, lazy_load_meshes=False):
+        """Parses the URDF file, <gazebo> blocks included"""
+        return cls(etree.parse(urdf_path), os.path.dirname(urdf_path), lazy_load_meshes)
+
+    @classmethod
+    def from_bytes(cls, urdf_bytes, path='', lazy_load_meshes=False):
+        """Parses the URDF content from memory"""
+        return cls(etree.ElementTree(etree.fromstring(urdf_bytes)), path, lazy_load_meshes)
+
+    def detach(self):
+        """Stops observing the robot elements"""
+        for element in self.robot.links + self.robot.joints:
+            detach_observer(element, self)
+
+    def on_element_change(self, element, field):
+        self.touched[(element, field)] = None
+
+    def sync(self):
+        """Writes the fields changed since the last sync to the XML tree"""
+        for element, field in self.touched:
+            elements = self.link_elements if field not in (ElementField.JOINT_ORIGIN, ElementField.JOINT_TYPE) else self.joint_elements
+            _field_writers[field](elements[element.name], element)
+        self.touched = {}
+
+    def to_bytes(self):
+        """Returns the content of the URDF with the current state of the robot"""
+        self.sync()
+        return etree.tostring(self.tree, xml_declaration=True, encoding='UTF-8')
+
+    def save(self, filename):
+        """Saves the URDF with the current state of the robot to filename"""
+        self.sync()
+        self.tree.write(filename, xml_declaration=True, encoding='UTF-8')
@@ -0,0 +1,55 @@
+import json
+import numpy as np
+from urchin import Joint
+from urdfModifiers.core.modificationJournal import get_field_value, set_field_value
+from urdfModifiers.core.modifier import notify_observers
+from urdfModifiers.core.robotIndex import RobotIndex
+from urdfModifiers.geometry.geometry import ElementField
+
+def _encode_value(value):
+    if isinstance(value, str):
+        return value
+    return np.asarray(value, dtype=float).tolist()
+
+def _decode_value(value):
+    if isinstance(value, str):
+        return value
+    if isinstance(value, list):
+        return np.array(value, dtype=float)
+    return float(value)
+
+def create_patch(touched, robot_name=None)-> dict:
+    """Returns the patch holding the current value of every (element, field) pair in touched, e.g. the touched
+    property of a ModificationJournal. The patch is a dictionary that can be serialized to JSON, of the form
+    {"robot": name, "links": {link name: {field name: value}}, "joints": {joint name: {field name: value}}}"""
+    patch = {"robot": robot_name, "links": {}, "joints": {}}
+    for element, field in touched:
+        elements = patch["joints"] if isinstance(element, Joint) else patch["links"]
+        elements.setdefault(element.name, {})[field.name.lower()] = _encode_value(get_field_value(element, field))
+    return patch
+
+def write_patch_to_file(patch:dict, filename:str):
+    """Saves the patch to a compact .json file"""
+    with open(filename, 'w') as f:
+        json.dump(patch, f, separators=(',', ':'))
+
+def load_patch_from_file(filename:str)-> dict:
+    """Reads a patch saved by write_patch_to_file"""
+    with open(filename) as f:
+        return json.load(f)
+
+def apply_patch(base, patch:dict, robot_index:RobotIndex=None):
+    """Writes the values of the patch to the links and joints of the base robot, which is returned.
+    The observers of the elements (e.g. a ModificationJournal) are notified of every written field"""
+    if robot_index is None:
+        robot_index = RobotIndex(base)
+    for elements_key, get_element in [("links", robot_index.get_link), ("joints", robot_index.get_joint)]:
+        for element_name, values in patch[elements_key].items():
+            element = get_element(element_name)
+            if element is None:
+                raise Exception(f"Element {element_name} of the patch not found in the robot")
+            for field_name, value in values.items():
+                field = ElementField[field_name.upper()]
+                notify_observers(element, field)
+                set_field_value(element, field, _decode_value(value))
+    return base
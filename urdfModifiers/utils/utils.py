@@ -1,20 +1,90 @@
-from typing import Tuple
-from urchin import URDF
+from typing import BinaryIO, List, Tuple
+from lxml import etree
+import networkx as nx
+from urchin import URDF, Collision, Geometry, Link, Material, Mesh, Texture, Visual
+from urdfModifiers.core.evaluation import ShadowRobot
 from urdfModifiers.geometry import *
+import copy
+import gzip
 import os
+import re
 
-def write_urdf_to_file(urdf, filename, gazebo_plugins=[]):
+# Matches every line spanning a <gazebo> ... </gazebo> block, including the line terminator
+_GAZEBO_BLOCK_PATTERN = re.compile(rb'^[^\n]*<\s*gazebo\b.*?<\s*/\s*gazebo[^\n]*(?:\n|$)', re.MULTILINE | re.DOTALL)
+
+class _MeshReference(Mesh):
+    """Mesh written as a reference to its file, without loading or exporting the mesh data"""
+    def __init__(self, mesh:Mesh):
+        super().__init__(mesh.filename, mesh.combine, mesh.scale, lazy_filename=mesh.filename)
+
+    def _to_xml(self, parent, path):
+        return self._unparse(path)
+
+class _TextureReference(Texture):
+    """Texture written as a reference to its file, without saving the image"""
+    def __init__(self, texture:Texture):
+        super().__init__(texture.filename, texture.image)
+
+    def _to_xml(self, parent, path):
+        return self._unparse(path)
+
+def _with_mesh_reference(geometry:Geometry)-> Geometry:
+    if geometry.mesh is None:
+        return geometry
+    return Geometry(mesh=_MeshReference(geometry.mesh))
+
+def _with_file_references(link:Link)-> Link:
+    if all(item.geometry.mesh is None for item in link.visuals + link.collisions):
+        return link
+    visuals = [Visual(_with_mesh_reference(visual.geometry), visual.name, visual.origin, visual.material) for visual in link.visuals]
+    collisions = [Collision(collision.name, collision.origin, _with_mesh_reference(collision.geometry)) for collision in link.collisions]
+    return Link(link.name, link.inertial, visuals, collisions)
+
+def _unparse_robot_with_file_references(urdf:URDF)-> etree._Element:
+    """Returns the <robot> node of the URDF as URDF._to_xml does, with meshes and textures written as references to
+    their files as they are, so that nothing is written to disk. Links with meshes and materials with textures are
+    unparsed from copies built with the public urchin constructors, every other element by urchin itself"""
+    node = etree.Element('robot', name=urdf.name)
+    for link in urdf.links:
+        node.append(_with_file_references(link)._to_xml(node, ''))
+    for element in urdf.joints + urdf.transmissions:
+        node.append(element._to_xml(node, ''))
+    for material in urdf.materials:
+        if material.texture is not None:
+            material = Material(material.name, material.color, _TextureReference(material.texture))
+        node.append(material._to_xml(node, ''))
+    if urdf.other_xml:
+        node.extend(etree.fromstring(urdf.other_xml))
+    return node
+
+def _robot_to_xml(urdf:URDF, path:str=None)-> etree._Element:
+    """Returns the <robot> node of the URDF. Meshes and textures are exported w.r.t. path as urchin does, or,
+    if path is None, written as references to their files as they are, so that nothing is written to disk"""
+    if path is not None:
+        return urdf._to_xml(None, path)
+    return _unparse_robot_with_file_references(urdf)
+
+def write_urdf_to_file(urdf, filename, gazebo_plugins=[], compress=False):
     """Saves the URDF to a valid .urdf file, also adding the gazebo_plugins"""
-    urdf.save(filename)
-    lines = []
-    with open(filename, 'r') as f:
-        lines = f.readlines()
-        last_line = lines.pop()
-        lines = lines + gazebo_plugins
-        lines.append(last_line)
+    with open(filename, 'wb') as f:
+        write_urdf_to_stream(urdf, f, gazebo_plugins, compress, os.path.dirname(filename))
+
+def write_urdf_to_stream(urdf:URDF, stream:BinaryIO, gazebo_plugins=[], compress:bool=False, path:str=None):
+    """Serializes the URDF to a binary stream, inserting the gazebo_plugins (text or bytes) before the closing </robot> tag.
+    If compress is True the output is gzip compressed. Meshes are exported w.r.t. path, which defaults to the directory of
+    file streams. For other streams (e.g. io.BytesIO) meshes are not exported and their file names are written as they are"""
+    if path is None and isinstance(getattr(stream, 'name', None), str):
+        path = os.path.dirname(os.path.realpath(stream.name))
+    urdf_bytes = etree.tostring(_robot_to_xml(urdf, path), pretty_print=True, xml_declaration=True, encoding='UTF-8')
+    closing_tag_position = urdf_bytes.rindex(b'</robot>')
 
-    with open(filename, 'w') as f:
-        f.writelines(lines)
+    output = gzip.GzipFile(fileobj=stream, mode='wb') if compress else stream
+    output.write(urdf_bytes[:closing_tag_position])
+    for plugin in gazebo_plugins:
+        output.write(plugin.encode('utf-8') if isinstance(plugin, str) else plugin)
+    output.write(urdf_bytes[closing_tag_position:])
+    if compress:
+        output.close()
 
 def separate_gazebo_plugins(filename):
     """Splits the URDF content in two parts: one relative to the robot and another to the gazebo plugins"""
@@ -43,9 +113,66 @@ def erase_dummy_file(dummy_filename):
     """Erases the dummy file"""
     os.remove(dummy_filename)
 
-def load_robot_and_gazebo_plugins(urdf_path:str, dummy_fileName:str)-> Tuple[URDF,str]:
-    main_urdf, gazebo_plugin_text = separate_gazebo_plugins(urdf_path)
-    create_dummy_file(dummy_fileName, main_urdf)
-    robot = URDF.load(dummy_fileName)
-    erase_dummy_file(dummy_fileName)
-    return robot, gazebo_plugin_text
\ No newline at end of file
+def split_gazebo_plugins(urdf_bytes:bytes)-> Tuple[bytes,List[bytes]]:
+    """Splits the URDF content in a single pass into the robot description and the raw <gazebo> blocks"""
+    robot_chunks = []
+    gazebo_blocks = []
+    start = 0
+    for match in _GAZEBO_BLOCK_PATTERN.finditer(urdf_bytes):
+        robot_chunks.append(urdf_bytes[start:match.start()])
+        gazebo_blocks.append(match.group())
+        start = match.end()
+    robot_chunks.append(urdf_bytes[start:])
+    return b''.join(robot_chunks), gazebo_blocks
+
+def load_robot_from_tree(root:etree._Element, path:str='', lazy_load_meshes:bool=False)-> URDF:
+    """Builds the robot from an already parsed <robot> element. Relative mesh paths are resolved w.r.t. path"""
+    return URDF._from_xml(root, path, lazy_load_meshes)
+
+def load_robot_from_bytes(urdf_bytes:bytes, path:str='', lazy_load_meshes:bool=False)-> URDF:
+    """Parses the robot straight from memory, without going through a file on disk"""
+    parser = etree.XMLParser(remove_comments=True, remove_blank_text=True)
+    return load_robot_from_tree(etree.fromstring(urdf_bytes, parser=parser), path, lazy_load_meshes)
+
+def load_robot_and_gazebo_plugins_from_bytes(urdf_bytes:bytes, path:str='')-> Tuple[URDF,List[bytes]]:
+    """Loads the robot from the URDF content, returning the <gazebo> blocks as raw byte slices"""
+    main_urdf, gazebo_blocks = split_gazebo_plugins(urdf_bytes)
+    return load_robot_from_bytes(main_urdf, path), gazebo_blocks
+
+def load_robot_and_gazebo_plugins(urdf_path:str, dummy_fileName:str=None)-> Tuple[URDF,List[str]]:
+    """Loads the robot from a URDF file, separating the <gazebo> blocks in memory.
+    dummy_fileName is kept for backwards compatibility and no longer used, since no intermediate file is written"""
+    with open(urdf_path, 'rb') as f:
+        urdf_bytes = f.read()
+    robot, gazebo_blocks = load_robot_and_gazebo_plugins_from_bytes(urdf_bytes, os.path.dirname(urdf_path))
+    return robot, [block.decode('utf-8') for block in gazebo_blocks]
+
+
+def clone_robot(robot:URDF)-> URDF:
+    """Returns an eager clone of the robot in which only the fields that modifiers can change are copied, up front:
+    origins, geometry primitives, inertials and joint types. Meshes, materials, transmissions and joint limits are
+    shared with robot, so modifying the clone never changes robot.
+    The URDF constructor is skipped: the structure computed by urchin (link graph, base link, paths to the base and
+    topological order) is copied from robot, with its links and joints replaced by their clones"""
+    shadow_robot = ShadowRobot(robot)
+    cloned_links = dict(zip(robot.links, shadow_robot.links))
+    cloned_joints = dict(zip(robot.joints, shadow_robot.joints))
+    cloned_robot = copy.copy(robot)
+    cloned_robot._links = shadow_robot.links
+    cloned_robot._joints = shadow_robot.joints
+    cloned_robot._transmissions = robot.transmissions
+    cloned_robot._materials = robot.materials
+    cloned_robot._link_map = {link.name: link for link in shadow_robot.links}
+    cloned_robot._joint_map = {joint.name: joint for joint in shadow_robot.joints}
+    cloned_robot._transmission_map = robot.transmission_map
+    cloned_robot._material_map = robot.material_map
+    cloned_robot._G = nx.DiGraph()
+    cloned_robot._G.add_nodes_from(shadow_robot.links)
+    cloned_robot._G.add_edges_from((cloned_links[child], cloned_links[parent], {'joint': cloned_joints[joint]})
+                                   for child, parent, joint in robot._G.edges(data='joint'))
+    cloned_robot._base_link = cloned_links[robot.base_link]
+    cloned_robot._end_links = [cloned_links[link] for link in robot.end_links]
+    cloned_robot._paths_to_base = {cloned_links[link]: [cloned_links[path_link] for path_link in path] for link, path in robot._paths_to_base.items()}
+    cloned_robot._actuated_joints = [cloned_joints[joint] for joint in robot.actuated_joints]
+    cloned_robot._reverse_topo = [cloned_links[link] for link in robot._reverse_topo]
+    return cloned_robot
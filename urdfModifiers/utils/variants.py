@@ -0,0 +1,100 @@
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+import os
+from urdfModifiers.core.evaluation import RobotEvaluation
+from urdfModifiers.core.modificationJournal import ModificationJournal
+from urdfModifiers.core.modificationPlan import ModificationPlan
+from urdfModifiers.core.robotIndex import RobotIndex
+from urdfModifiers.utils.patch import create_patch, write_patch_to_file
+from urdfModifiers.utils.utils import load_robot_and_gazebo_plugins_from_bytes, write_urdf_to_file
+
+# Template robot, gazebo blocks, robot index and journal created once by each worker process
+_template = None
+
+@dataclass
+class VariantResult():
+    """Class describing the outcome of the generation of one variant"""
+    index: int
+    path: str = None
+    error: str = None
+    evaluation: RobotEvaluation = None
+
+def _initialize_template(template_bytes, template_path):
+    global _template
+    template_robot, gazebo_blocks = load_robot_and_gazebo_plugins_from_bytes(template_bytes, template_path)
+    _template = (template_robot, gazebo_blocks, RobotIndex(template_robot), ModificationJournal(template_robot))
+
+def _generate_variant(index, plan, output_path, patch=False):
+    template_robot, gazebo_blocks, template_index, template_journal = _template
+    try:
+        plan.apply(template_robot, template_index)
+        if patch:
+            write_patch_to_file(create_patch(template_journal.touched, template_robot.name), output_path)
+        else:
+            write_urdf_to_file(template_robot, output_path, gazebo_blocks)
+        return VariantResult(index, output_path)
+    except Exception as e:
+        return VariantResult(index, output_path, f"{type(e).__name__}: {e}")
+    finally:
+        template_journal.rollback()
+
+def _evaluate_variant(index, plan):
+    template_robot, _, template_index, _ = _template
+    try:
+        return VariantResult(index, evaluation=plan.evaluate(template_robot, template_index))
+    except Exception as e:
+        return VariantResult(index, error=f"{type(e).__name__}: {e}")
+
+def _as_plan(modification_set):
+    if isinstance(modification_set, ModificationPlan):
+        return modification_set
+    return ModificationPlan.from_modifications(modification_set)
+
+def _run_tasks(task_function, tasks, template, workers):
+    global _template
+    with open(template, 'rb') as f:
+        template_bytes = f.read()
+    template_path = os.path.dirname(os.path.abspath(template))
+    if workers == 1:
+        _initialize_template(template_bytes, template_path)
+        try:
+            return [task_function(*task) for task in tasks]
+        finally:
+            # Do not keep the template alive in the calling process
+            _template[3].detach()
+            _template = None
+
+    workers = workers if workers is not None else os.cpu_count() or 1
+    max_pending = 4 * workers
+    results = []
+    with ProcessPoolExecutor(max_workers=workers, initializer=_initialize_template, initargs=(template_bytes, template_path)) as executor:
+        pending = deque()
+        for task in tasks:
+            pending.append(executor.submit(task_function, *task))
+            if len(pending) >= max_pending:
+                results.append(pending.popleft().result())
+        results += [future.result() for future in pending]
+    return results
+
+def generate_variants(template, modification_sets, out_dir, workers=None, file_name=None, patch=False):
+    """Writes one URDF to out_dir for every modification set, given as a ModificationPlan or a dictionary mapping
+    element names to Modification classes. The template (a file path) is read once and parsed once per worker process,
+    and only the modification sets are sent to the workers, which roll the template back after every variant.
+    The modification sets can be a generator: at most a few per worker are pending at any time. Returns the
+    VariantResult of every set in input order, with the error message of the sets that failed.
+    If workers is 1 the variants are generated in the current process.
+    If patch is True, only the fields changed w.r.t. the template are written, as a JSON patch (see utils.patch.apply_patch).
+    file_name defaults to variant_{index}.urdf, or variant_{index}.json for patches"""
+    os.makedirs(out_dir, exist_ok=True)
+    if file_name is None:
+        file_name = "variant_{index}.json" if patch else "variant_{index}.urdf"
+    tasks = ((index, _as_plan(modification_set), os.path.join(out_dir, file_name.format(index=index)), patch)
+             for index, modification_set in enumerate(modification_sets))
+    return _run_tasks(_generate_variant, tasks, template, workers)
+
+def evaluate_variants(template, modification_sets, workers=None):
+    """Same as generate_variants, but nothing is written: the VariantResult of every set holds the RobotEvaluation
+    (masses, inertias and origins) of the variant, computed without modifying the template robot"""
+    tasks = ((index, _as_plan(modification_set)) for index, modification_set in enumerate(modification_sets))
+    return _run_tasks(_evaluate_variant, tasks, template, workers)